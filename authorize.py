@@ -0,0 +1,37 @@
+from PyQt5.QtCore import *
+from PyQt5.QtWidgets import *
+from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor
+from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineView
+
+
+class AuthorizeLS(QMainWindow):
+    def __init__(self, auth_url: object):
+        QMainWindow.__init__(self)
+        self.auth_url = auth_url
+        self.page = QWebEnginePage()
+        self.view = QWebEngineView()
+        self.view.setPage(self.page)
+        self.interceptor = AuthCodeInterceptor()
+        self.page.profile().setRequestInterceptor(self.interceptor)
+        self.view.setUrl(QUrl(self.auth_url))
+        self.view.show()
+
+    def check_code(self):
+        return self.interceptor.code
+
+
+class AuthCodeInterceptor(QWebEngineUrlRequestInterceptor):
+    code_returned = pyqtSignal()
+
+    def __init__(self):
+        super().__init__()
+
+        self.code = ""
+
+    def interceptRequest(self, info):
+        url = info.firstPartyUrl().toString()
+
+        if "localhost" in url:
+            code = url.split("code=")[1]
+            self.code = code
+            self.code_returned.emit()
@@ -0,0 +1,37 @@
+import lsapi
+
+
+def balance_query_parameters(customer_type_ids):
+    """
+    Build the Lightspeed query parameters for customers of the given types that owe a balance.
+    Lightspeed filters on the customer type and on the balance of the loaded CreditAccount relation.
+    :param customer_type_ids: list of customerTypeIDs to export balances for
+    :return: dictionary of url parameters
+    """
+    parameters = {
+        'load_relations': '["CreditAccount"]',
+        'CreditAccount.balance': '>,0'
+    }
+
+    if len(customer_type_ids) == 1:
+        parameters['customerTypeID'] = str(customer_type_ids[0])
+    else:
+        parameters['customerTypeID'] = 'IN,[{}]'.format(",".join(str(i) for i in customer_type_ids))
+
+    return parameters
+
+
+def customers_with_balance(ls, customer_type_ids):
+    """
+    Stream customers of the given types with a balance on their credit account.
+    The balance and type are checked again client-side in case the API ignored a filter.
+    :param ls: Lightspeed API client
+    :param customer_type_ids: list of customerTypeIDs to export balances for
+    :return: generator of Customer records
+    """
+    type_ids = [int(i) for i in customer_type_ids]
+    for i in lsapi.iter_records(ls, "Customer", parameters=balance_query_parameters(customer_type_ids)):
+        if 'CreditAccount' not in i:
+            continue
+        if float(i['CreditAccount']['balance']) > 0 and int(i['customerTypeID']) in type_ids:
+            yield i
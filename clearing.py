@@ -0,0 +1,316 @@
+import os
+import uuid
+import sqlite3
+import datetime
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import config
+import lsapi
+
+# Number of clears sent to Lightspeed at the same time. Their POSTs share the client's rate limiter.
+CLEARING_WORKERS = 4
+
+# Clearing sales are looked for from this long before a clear was sent, allowing for clock differences.
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+# Times a clear is sent before an entry Lightspeed keeps rejecting is given up on.
+CLEAR_ATTEMPTS = 3
+
+# Ledger entry states. Skipped entries no longer matched the customer's balance, abandoned entries
+# were rejected CLEAR_ATTEMPTS times. Both are left for someone to clear by hand.
+PENDING = "pending"
+SENT = "sent"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+SKIPPED = "skipped"
+ABANDONED = "abandoned"
+
+
+def default_path(account_id, profile=None):
+    """
+    Location of the clearing ledger for a Lightspeed account. Kept next to the settings file.
+    Each profile other than the default has its own, so profiles of the same account never share one.
+    :param account_id: Lightspeed account id
+    :param profile: settings profile name
+    :return: path to sqlite database
+    """
+    name = "lightspeed-vc-connector-clearing-%s.db" % account_id
+    if profile is not None and profile != config.DEFAULT_PROFILE:
+        name = "lightspeed-vc-connector-clearing-%s-%s.db" % (account_id, config.check_profile_name(profile))
+    return os.path.join(os.path.dirname(config.config_file_location()), name)
+
+
+def clear_request(customer_id, amount, payment_type_id, credit_account_id, employee_id):
+    """
+    Format the negative Sale that clears a credit account balance.
+    :param customer_id: Lightspeed customerID
+    :param amount: balance to clear as a string
+    :param payment_type_id: paymentTypeID used for the clearing payment
+    :param credit_account_id: creditAccountID of the customer
+    :param employee_id: employeeID the sale is made as
+    :return: Sale data
+    """
+    return {
+        "employeeID": employee_id,
+        "registerID": 1,
+        "shopID": 1,
+        "customerID": customer_id,
+        "completed": 'true',
+        "SaleLines": {
+            "SaleLine": {
+                "itemID": 0,
+                "note": "Balance Cleared by LSVCConnector",
+                "unitQuantity": 1,
+                "unitPrice": -float(amount),
+                "taxClassID": 0,
+                "avgCost": 0,
+                "fifoCost": 0
+            }
+        },
+        "SalePayments": {
+            "SalePayment": {
+                "amount": -float(amount),
+                "paymentTypeID": payment_type_id,
+                "creditAccountID": credit_account_id
+            }
+        }
+    }
+
+
+def new_batch():
+    """
+    Unique id for a clearing run.
+    :return: batch id
+    """
+    return uuid.uuid4().hex
+
+
+class ClearingEngine:
+    """
+    Clears credit account balances through a durable ledger.
+    Every clear is written to the ledger before it is sent, so an interrupted run can be finished
+    later without clearing anyone twice.
+    """
+
+    def __init__(self, ls, path, log, workers=CLEARING_WORKERS):
+        self.ls = ls
+        self.path = path
+        self.log = log
+        self.workers = workers
+        self.lock = threading.Lock()
+
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS ledger ("
+                       "batch TEXT, "
+                       "customerID INTEGER, "
+                       "creditAccountID INTEGER, "
+                       "amount TEXT, "
+                       "paymentTypeID INTEGER, "
+                       "employeeID INTEGER, "
+                       "status TEXT, "
+                       "saleID TEXT, "
+                       "updated TEXT, "
+                       "sent TEXT, "
+                       "attempts INTEGER DEFAULT 0, "
+                       "file TEXT, "
+                       "PRIMARY KEY (batch, customerID))")
+            # Ledgers written before clears recorded when they were sent, how often and from which file.
+            columns = [r[1] for r in db.execute("PRAGMA table_info(ledger)")]
+            if "sent" not in columns:
+                db.execute("ALTER TABLE ledger ADD COLUMN sent TEXT")
+            if "attempts" not in columns:
+                db.execute("ALTER TABLE ledger ADD COLUMN attempts INTEGER DEFAULT 0")
+            if "file" not in columns:
+                db.execute("ALTER TABLE ledger ADD COLUMN file TEXT")
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Open the ledger for one transaction.
+        :return: sqlite connection, committed and closed on exit
+        """
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def set_status(self, batch, customer_id, status, sale_id=None):
+        with self.lock, self.connect() as db:
+            db.execute("UPDATE ledger SET status = ?, saleID = ?, updated = ? WHERE batch = ? AND customerID = ?",
+                       (status, sale_id, datetime.datetime.now().isoformat(), batch, customer_id))
+            if status == SENT:
+                db.execute("UPDATE ledger SET sent = ?, attempts = attempts + 1 WHERE batch = ? AND customerID = ?",
+                           (datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                            batch, customer_id))
+
+    def confirmed_sales(self, customer_id):
+        """
+        Clearing sales already matched to ledger entries of a customer.
+        :param customer_id: Lightspeed customerID
+        :return: set of saleIDs
+        """
+        with self.lock, self.connect() as db:
+            return {str(r[0]) for r in db.execute("SELECT saleID FROM ledger WHERE customerID = ? AND status = ? "
+                                                  "AND saleID IS NOT NULL", (customer_id, CONFIRMED))}
+
+    def record(self, batch, customer_id, credit_account_id, amount, payment_type_id, employee_id, file=None):
+        """
+        Write an intended clear to the ledger. Recording the same customer twice in a batch does nothing.
+        :param batch: unique id of the clearing run, from new_batch
+        :param customer_id: Lightspeed customerID
+        :param credit_account_id: creditAccountID of the customer
+        :param amount: balance to clear as a string
+        :param payment_type_id: paymentTypeID used for the clearing payment
+        :param employee_id: employeeID the sale is made as
+        :param file: balance export file the clear was exported to
+        :return: nothing
+        """
+        with self.lock, self.connect() as db:
+            db.execute("INSERT OR IGNORE INTO ledger (batch, customerID, creditAccountID, amount, paymentTypeID, "
+                       "employeeID, status, updated, file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (batch, customer_id, credit_account_id, amount, payment_type_id, employee_id, PENDING,
+                        datetime.datetime.now().isoformat(), file))
+
+    def unfinished(self, batch=None):
+        """
+        Ledger entries that are still to be cleared.
+        :param batch: limit to one clearing run
+        :return: list of entry dictionaries
+        """
+        query = "SELECT * FROM ledger WHERE status IN (?, ?, ?)"
+        parameters = [PENDING, SENT, FAILED]
+        if batch is not None:
+            query += " AND batch = ?"
+            parameters.append(batch)
+
+        with self.lock, self.connect() as db:
+            db.row_factory = sqlite3.Row
+            return [dict(r) for r in db.execute(query, parameters)]
+
+    def already_applied(self, entry):
+        """
+        Look for the clearing sale of a clear that was sent without a confirmed result.
+        A clear went through when there is a sale by the ledger employee with a payment of the ledger
+        amount back to the credit account, with the ledger payment type, made after the clear was sent.
+        :param entry: ledger entry
+        :return: saleID of the clearing sale, or None
+        """
+        import currency
+
+        parameters = dict(customerID=entry['customerID'],
+                          employeeID=entry['employeeID'],
+                          completed='true',
+                          load_relations='["SalePayments"]')
+        if entry.get('sent'):
+            since = datetime.datetime.fromisoformat(entry['sent']) - CLOCK_SKEW
+            parameters['timeStamp'] = '>=,{}'.format(since.isoformat())
+
+        # A sale already matched to another entry is not this clear.
+        confirmed = self.confirmed_sales(entry['customerID'])
+        amount = -currency.Currency.parse(entry['amount'])
+
+        for sale in lsapi.get_records(self.ls, "Sale", parameters=parameters):
+            if str(sale['saleID']) in confirmed:
+                continue
+            for p in sale.get('SalePayments', {}).get('SalePayment', []):
+                if str(p.get('paymentTypeID')) == str(entry['paymentTypeID']) and \
+                        str(p.get('creditAccountID')) == str(entry['creditAccountID']) and \
+                        currency.Currency.parse(p['amount']) == amount:
+                    return sale['saleID']
+        return None
+
+    def current_balance(self, entry):
+        """
+        Balance the customer of a ledger entry owes now.
+        :param entry: ledger entry
+        :return: Currency
+        """
+        import currency
+
+        parameters = dict(customerID=entry['customerID'], load_relations='["CreditAccount"]')
+        for customer in lsapi.get_records(self.ls, "Customer", parameters=parameters):
+            if customer.get('CreditAccount'):
+                return currency.Currency.parse(customer['CreditAccount']['balance'])
+        return currency.Currency()
+
+    def clear(self, entry, recheck=False):
+        """
+        Send one ledger entry to Lightspeed.
+        Entries that were sent before without a confirmed result are checked first. Entries left from
+        an earlier export are only sent while the customer still owes the amount in the ledger.
+        :param entry: ledger entry
+        :param recheck: compare the ledger amount with the customer's balance before sending
+        :return: True when the clear is confirmed, False when it failed, None when it was skipped
+        """
+        import currency
+
+        try:
+            if entry['status'] in (SENT, FAILED):
+                sale_id = self.already_applied(entry)
+                if sale_id is not None:
+                    self.set_status(entry['batch'], entry['customerID'], CONFIRMED, sale_id)
+                    self.log("Balance of customerID {} was already cleared by Sale #{}.".format(entry['customerID'],
+                                                                                                sale_id), "info")
+                    return True
+
+            if recheck:
+                balance = self.current_balance(entry)
+                if balance != currency.Currency.parse(entry['amount']):
+                    self.set_status(entry['batch'], entry['customerID'], SKIPPED)
+                    self.log("Not clearing customerID {} from {}, the balance changed since it was exported. "
+                             "It was {}.".format(entry['customerID'], entry['file'] or entry['batch'],
+                                                 entry['amount']), "window,info")
+                    return None
+
+            self.set_status(entry['batch'], entry['customerID'], SENT)
+            r = self.ls.create('Sale', data=clear_request(entry['customerID'],
+                                                          entry['amount'],
+                                                          entry['paymentTypeID'],
+                                                          entry['creditAccountID'],
+                                                          entry['employeeID']))
+        except Exception as error:
+            # The outcome is unknown, the entry stays sent and is checked on the next run.
+            self.log("Unable to clear balance for customerID {}".format(entry['customerID']), "info")
+            self.log(str(error), "debug")
+            return False
+
+        if not isinstance(r, dict) or 'Sale' not in r:
+            self.log("Unable to clear balance for customerID {}".format(entry['customerID']), "info")
+            self.log(str(r), "debug")
+            if (entry.get('attempts') or 0) + 1 >= CLEAR_ATTEMPTS:
+                # Lightspeed rejected it every time, sending it again will not help.
+                self.set_status(entry['batch'], entry['customerID'], ABANDONED)
+                self.log("Gave up clearing customerID {} from {} after {} attempts. "
+                         "Clear the balance by hand.".format(entry['customerID'], entry['file'] or entry['batch'],
+                                                             CLEAR_ATTEMPTS), "window,info")
+            else:
+                self.set_status(entry['batch'], entry['customerID'], FAILED)
+            return False
+
+        self.set_status(entry['batch'], entry['customerID'], CONFIRMED, r['Sale']['saleID'])
+        self.log("Cleared balance of {} of customerID {}".format(entry['amount'], entry['customerID']), "info")
+        return True
+
+    def run(self, batch=None):
+        """
+        Send every unfinished clear through a bounded pool. Confirmed entries are skipped.
+        Without a batch, the entries left by earlier exports are finished. Their customers' balances are
+        read again first, and entries that no longer match are skipped.
+        :param batch: limit to one clearing run, just recorded
+        :return: tuple of cleared and failed counts
+        """
+        entries = self.unfinished(batch)
+        if not entries:
+            return 0, 0
+
+        # Refresh the token once up front instead of from every clear.
+        self.ls.get_token()
+
+        recheck = batch is None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(lambda e: self.clear(e, recheck), entries))
+
+        return results.count(True), results.count(False)
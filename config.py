@@ -1,40 +1,307 @@
 import sys
 import os
+import re
+import json
+import dbm
 import shelve
-import pyAesCrypt
+import tempfile
+import threading
+import contextlib
 
 default_config = dict()
 
-if sys.platform == "darwin":
-    # OS X
-    config_file = os.environ['HOME'] + '/Library/Preferences/lightspeed-vc-connector-prefs'
-    config_file_extension = ".db"
-    if not os.path.isfile(config_file + config_file_extension):
-        d = shelve.open(config_file, flag='c', writeback=True)
-        d["config"] = default_config
-        d.sync()
-        d.close()
+# Environment variable that overrides the settings location, such as /tmp/test/prefs.
+CONFIG_ENV = "LSVC_CONFIG"
 
-elif "win" in sys.platform:
-    # Windows
-    config_file = os.environ['LOCALAPPDATA'] + "\lightspeed-vc-connector-prefs"
-    config_file_extension = ".dat"
-    if not os.path.isfile(config_file + config_file_extension):
-        if not os.path.isfile(config_file + ".aes"):
-            d = shelve.open(config_file, flag='c', writeback=True)
-            d["config"] = default_config
-            d.sync()
-            d.close()
-
-else:
-    config_file = "lightspeed-vc-connector-prefs"
-    if not os.path.isfile(config_file):
-        d = shelve.open(config_file, flag='c', writeback=True)
-        d["config"] = default_config
-        d.sync()
-        d.close()
+# Settings base name. Files are named from it, such as lightspeed-vc-connector-prefs.json.aes.
+CONFIG_NAME = "lightspeed-vc-connector-prefs"
+
+# Profile used when none is chosen. Its settings are kept under the original "config" key.
+DEFAULT_PROFILE = "default"
+
+# Settings keys of the other profiles start with this, such as profile:north-campus.
+PROFILE_PREFIX = "profile:"
+
+# Profile names are used in file names, such as the profile's token cache and log.
+PROFILE_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+# Settings location set with set_config_file, resolved on first use otherwise.
+_config_file = None
+_config_lock = threading.Lock()
+
+# Settings store opened with the session password.
+_store = None
+_store_lock = threading.Lock()
+
+
+def default_config_file():
+    """
+    Platform settings location. Only computes the path, nothing is created.
+    :return: settings base path without extension
+    """
+    if sys.platform == "darwin":
+        # OS X
+        return os.path.join(os.environ['HOME'], 'Library', 'Preferences', CONFIG_NAME)
+    elif "win" in sys.platform:
+        # Windows
+        return os.path.join(os.environ['LOCALAPPDATA'], CONFIG_NAME)
+
+    # Settings used to be kept in the working directory. Keep using them when they are there.
+    if dbm.whichdb(CONFIG_NAME) or os.path.isfile(CONFIG_NAME + ".json.aes"):
+        return os.path.abspath(CONFIG_NAME)
+    config_home = os.environ.get('XDG_CONFIG_HOME', os.path.join(os.path.expanduser('~'), '.config'))
+    return os.path.join(config_home, CONFIG_NAME)
+
+
+def set_config_file(path):
+    """
+    Use an explicit settings location, such as from the command line or a test.
+    :param path: settings base path without extension
+    :return: nothing
+    """
+    global _config_file, _store
+    with _config_lock:
+        _config_file = os.path.abspath(path)
+    with _store_lock:
+        _store = None
+
+
+def config_file_location():
+    """
+    Settings location. Set with set_config_file, then the LSVC_CONFIG environment variable,
+    then the platform default.
+    :return: settings base path without extension
+    """
+    global _config_file
+    with _config_lock:
+        if _config_file is None:
+            if os.environ.get(CONFIG_ENV):
+                _config_file = os.path.abspath(os.environ[CONFIG_ENV])
+            else:
+                _config_file = default_config_file()
+        return _config_file
+
+
+def settings_file():
+    """
+    Encrypted settings store. Replaces the encrypted shelve, which is only read to migrate it.
+    :return: path
+    """
+    return config_file_location() + ".json.aes"
+
+
+def legacy_file_extension():
+    """
+    Extension of the shelve file the older settings were kept in.
+    :return: extension
+    """
+    if sys.platform == "darwin":
+        return ".db"
+    elif "win" in sys.platform:
+        return ".dat"
+    return ""
+
+
+def legacy_enc_file():
+    """
+    Encrypted shelve the older settings were kept in.
+    :return: path
+    """
+    return config_file_location() + ".aes"
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on a lock file next to path, so one process at a time changes the file.
+    Waits for other processes to release it.
+    :param path: path of the file being changed
+    :return: nothing
+    """
+    with open(path + ".lock", "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            # LK_LOCK gives up after about 10 seconds, keep waiting.
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def file_stamp(path):
+    """
+    Identity of a file's current contents, which changes whenever it is replaced.
+    :param path: path
+    :return: tuple, or None when there is no file
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class SettingsStore:
+    """
+    Settings decrypted into memory. Plaintext settings never touch the disk.
+    Other processes, such as the runner, may change the same file. Changes are made under a file lock
+    to the settings read from disk, and reads pick up the file again when it was replaced.
+    """
+
+    def __init__(self, path, password):
+        self.path = path
+        self.password = password
+        # cryptography is only loaded once settings are opened, not when config is imported.
+        import crypto
 
-config_file_enc = config_file + ".aes"
+        # Keys derived from the password, dropped when it changes.
+        self.key_cache = crypto.KeyCache()
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.data = self.load()
+
+    def load(self):
+        """
+        Decrypt the settings into memory. Settings from the older encrypted shelve are migrated once.
+        Raises ValueError when the password is wrong.
+        :return: dictionary of settings
+        """
+        if not os.path.isfile(self.path):
+            with file_lock(self.path):
+                # Another process may have migrated them while this one waited.
+                if not os.path.isfile(self.path):
+                    self.data = load_legacy(self.password)
+                    self.save()
+                    return self.data
+        return self.read()
+
+    def read(self):
+        """
+        Decrypt the settings file.
+        :return: dictionary of settings
+        """
+        import crypto
+
+        stamp = file_stamp(self.path)
+        with open(self.path, "rb") as f:
+            data = json.loads(crypto.decrypt(f.read(), self.password, keys=self.key_cache).decode())
+        self.stamp = stamp
+        return data
+
+    def refresh(self):
+        """
+        Read the settings again when another process replaced the file. Called with the lock held.
+        :return: nothing
+        """
+        if file_stamp(self.path) != self.stamp:
+            self.data = self.read()
+
+    def save(self):
+        """
+        Encrypt the settings to a temporary file of its own and move it into place.
+        Called with the file lock held.
+        :return: nothing
+        """
+        import crypto
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path),
+                                         prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(crypto.encrypt(json.dumps(self.data).encode(), self.password, keys=self.key_cache))
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.stamp = file_stamp(self.path)
+
+    @contextlib.contextmanager
+    def change(self):
+        """
+        Change the settings as read from disk, then save them, holding the file lock throughout so no
+        other process's change is lost.
+        :return: dictionary of settings to change
+        """
+        with self.lock:
+            with file_lock(self.path):
+                if os.path.isfile(self.path):
+                    self.data = self.read()
+                yield self.data
+                self.save()
+
+    def get(self, key):
+        with self.lock:
+            self.refresh()
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.change() as data:
+            data[key] = value
+
+    def keys(self):
+        with self.lock:
+            self.refresh()
+            return list(self.data.keys())
+
+    def delete(self, key):
+        with self.change() as data:
+            del data[key]
+
+    def change_password(self, password):
+        with self.change():
+            self.password = password
+            self.key_cache.clear()
+
+
+def open_store(passwd):
+    """
+    Settings store for the session, decrypted the first time it is opened with a password.
+    :param passwd: settings password
+    :return: SettingsStore
+    """
+    global _store
+    with _store_lock:
+        if _store is None or _store.password != passwd:
+            os.makedirs(os.path.dirname(settings_file()), exist_ok=True)
+            _store = SettingsStore(settings_file(), passwd)
+        return _store
+
+
+def load_legacy(passwd):
+    """
+    Read every key of the older encrypted shelve, which has to be decrypted to disk to be opened.
+    :param passwd: settings password
+    :return: dictionary of settings
+    """
+    data = dict()
+    encrypted = os.path.isfile(legacy_enc_file())
+    if encrypted:
+        decrypt(password=passwd)
+    if dbm.whichdb(config_file_location()):
+        d = shelve.open(config_file_location(), flag='r')
+        data = dict(d)
+        d.close()
+    if encrypted:
+        encrypt(password=passwd)
+    if "config" not in data:
+        data["config"] = dict(default_config)
+    return data
 
 
 def check_enc():
@@ -42,7 +309,7 @@ def check_enc():
     Check that encrypted settings are present
     :return: True/False
     """
-    if os.path.isfile(config_file + ".aes"):
+    if os.path.isfile(settings_file()) or os.path.isfile(legacy_enc_file()):
         return True
     else:
         return False
@@ -54,10 +321,13 @@ def encrypt(password):
     :param password:
     :return:
     """
-    if not check_enc():
+    import pyAesCrypt
+
+    if not os.path.isfile(legacy_enc_file()):
         buffersize = 64 * 1024
-        pyAesCrypt.encryptFile(config_file + config_file_extension, config_file_enc, password, buffersize)
-        os.remove(config_file + config_file_extension)
+        plain_file = config_file_location() + legacy_file_extension()
+        pyAesCrypt.encryptFile(plain_file, legacy_enc_file(), password, buffersize)
+        os.remove(plain_file)
 
 
 def decrypt(password):
@@ -66,38 +336,31 @@ def decrypt(password):
     :param password:
     :return:
     """
-    if check_enc():
+    import pyAesCrypt
+
+    if os.path.isfile(legacy_enc_file()):
         buffersize = 64 * 1024
-        pyAesCrypt.decryptFile(config_file_enc, config_file + config_file_extension, password, buffersize)
-        os.remove(config_file_enc)
+        pyAesCrypt.decryptFile(legacy_enc_file(), config_file_location() + legacy_file_extension(), password,
+                               buffersize)
+        os.remove(legacy_enc_file())
 
 
 def save_settings(settings, key, passwd):
     """
-    Saves settings to the pickle file
+    Saves settings to the encrypted settings store
     :param settings:  data to save.
-    :param key: shelve key to save the data to
+    :param key: settings key to save the data to
     :return: nothing
     """
-    decrypt(password=passwd)
-    d = shelve.open(config_file, flag='c', writeback=True)
-    d[key] = settings
-    d.sync()
-    d.close()
-    encrypt(password=passwd)
+    open_store(passwd).set(key, settings)
 
 
 def load_settings(key, passwd):
     """
-    Get settings from pickle file
+    Get settings from the encrypted settings store
     :return: data from file
     """
-    decrypt(password=passwd)
-    d = shelve.open(config_file, flag='c', writeback=True)
-    s = d[key]
-    d.close()
-    encrypt(password=passwd)
-    return s
+    return dict(open_store(passwd).get(key))
 
 
 def change_password(old, new):
@@ -107,9 +370,76 @@ def change_password(old, new):
     :param new:
     :return:
     """
-    decrypt(password=old)
-    encrypt(password=new)
+    open_store(old).change_password(new)
 
 
-def config_file_location():
-    return config_file
+def check_profile_name(name):
+    """
+    Raise ValueError unless the profile name is letters, digits, _ and -, so it is safe in a file name.
+    :param name: profile name
+    :return: the name
+    """
+    if not isinstance(name, str) or not PROFILE_NAME.fullmatch(name):
+        raise ValueError("Profile name %r may only use letters, digits, _ and -." % (name,))
+    return name
+
+
+def profile_key(name):
+    """
+    Settings key of a profile.
+    Raises ValueError when the name is not valid.
+    :param name: profile name
+    :return: settings key
+    """
+    check_profile_name(name)
+    if name == DEFAULT_PROFILE:
+        return "config"
+    return PROFILE_PREFIX + name
+
+
+def list_profiles(passwd):
+    """
+    Names of the settings profiles, the default profile first.
+    :param passwd: settings password
+    :return: list of profile names
+    """
+    keys = open_store(passwd).keys()
+    names = sorted(k[len(PROFILE_PREFIX):] for k in keys if k.startswith(PROFILE_PREFIX))
+    if "config" in keys:
+        names.insert(0, DEFAULT_PROFILE)
+    return names
+
+
+def load_profile(name, passwd):
+    """
+    Get the settings of a profile.
+    Raises KeyError when there is no such profile, ValueError when the name is not valid.
+    :param name: profile name
+    :param passwd: settings password
+    :return: settings
+    """
+    return load_settings(profile_key(name), passwd)
+
+
+def save_profile(settings, name, passwd):
+    """
+    Save the settings of a profile, adding the profile when it is new.
+    Raises ValueError when the name is not valid.
+    :param settings: settings to save
+    :param name: profile name
+    :param passwd: settings password
+    :return: nothing
+    """
+    save_settings(settings, profile_key(name), passwd)
+
+
+def delete_profile(name, passwd):
+    """
+    Remove a profile. The default profile cannot be removed.
+    :param name: profile name
+    :param passwd: settings password
+    :return: nothing
+    """
+    if name == DEFAULT_PROFILE:
+        raise ValueError("The default profile cannot be deleted.")
+    open_store(passwd).delete(profile_key(name))
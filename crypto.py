@@ -0,0 +1,187 @@
+import io
+import os
+import json
+import struct
+import threading
+import pyAesCrypt
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+# Start of files written by this module. Files without it were written by pyAesCrypt.
+MAGIC = b"LSVC1"
+
+# Key derivation functions. scrypt is memory-hard, pbkdf2 is the default.
+KDF_PBKDF2 = "pbkdf2"
+KDF_SCRYPT = "scrypt"
+
+# KDF used for new files and its cost, PBKDF2 iterations or the scrypt log2 of N.
+# Set LSVC_KDF=scrypt and LSVC_KDF_COST to tune without changing code.
+DEFAULT_KDF = os.environ.get("LSVC_KDF", KDF_PBKDF2)
+DEFAULT_COST = {
+    KDF_PBKDF2: 600000,
+    KDF_SCRYPT: 17
+}
+
+# Lowest and highest cost accepted for each KDF, from the environment or a file header. The highest
+# keeps a damaged or crafted file from deriving a key for hours or with gigabytes of memory.
+COST_LIMITS = {
+    KDF_PBKDF2: (1000, 10000000),
+    KDF_SCRYPT: (10, 20)
+}
+
+
+def check_cost(kdf, cost):
+    """
+    Raise ValueError unless the KDF is known and its cost is within COST_LIMITS.
+    :param kdf: KDF_PBKDF2 or KDF_SCRYPT
+    :param cost: PBKDF2 iterations or scrypt log2 of N
+    :return: nothing
+    """
+    if kdf not in COST_LIMITS:
+        raise ValueError("Unknown key derivation function %s, use %s or %s." % (kdf, KDF_PBKDF2, KDF_SCRYPT))
+    low, high = COST_LIMITS[kdf]
+    if isinstance(cost, bool) or not isinstance(cost, int) or not low <= cost <= high:
+        raise ValueError("Key derivation cost %s for %s must be from %s to %s." % (cost, kdf, low, high))
+
+
+def default_cost(kdf):
+    """
+    Cost for a KDF, from LSVC_KDF_COST when set.
+    Raises ValueError when LSVC_KDF or LSVC_KDF_COST is not valid.
+    :param kdf: KDF_PBKDF2 or KDF_SCRYPT
+    :return: cost
+    """
+    if kdf not in DEFAULT_COST:
+        raise ValueError("Unknown key derivation function %s, set LSVC_KDF to %s or %s." %
+                         (kdf, KDF_PBKDF2, KDF_SCRYPT))
+    if kdf == DEFAULT_KDF and os.environ.get("LSVC_KDF_COST"):
+        try:
+            cost = int(os.environ["LSVC_KDF_COST"])
+        except ValueError:
+            raise ValueError("LSVC_KDF_COST must be a whole number, not %s." % os.environ["LSVC_KDF_COST"])
+        check_cost(kdf, cost)
+        return cost
+    return DEFAULT_COST[kdf]
+
+
+def derive_key(password, kdf, cost, salt):
+    """
+    Derive a 256 bit key from the password.
+    :param password: password
+    :param kdf: KDF_PBKDF2 or KDF_SCRYPT
+    :param cost: PBKDF2 iterations or scrypt log2 of N
+    :param salt: random salt
+    :return: key bytes
+    """
+    if kdf == KDF_SCRYPT:
+        f = Scrypt(salt=salt, length=32, n=2 ** cost, r=8, p=1)
+    elif kdf == KDF_PBKDF2:
+        f = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=cost)
+    else:
+        raise ValueError("Unknown key derivation function %s." % kdf)
+    return f.derive(password.encode())
+
+
+class KeyCache:
+    """
+    Keys derived from one password, by KDF, cost and salt, so each is only derived once.
+    Held by the owner of the password and cleared when the password changes. Only keys that
+    encrypted or decrypted something are kept.
+    """
+
+    def __init__(self):
+        self.keys = dict()
+        # Salt new files are encrypted with, by KDF and cost, so their key is reused.
+        self.salts = dict()
+        self.lock = threading.Lock()
+
+    def get(self, kdf, cost, salt):
+        with self.lock:
+            return self.keys.get((kdf, cost, salt))
+
+    def add(self, kdf, cost, salt, key):
+        with self.lock:
+            self.keys[(kdf, cost, salt)] = key
+            self.salts.setdefault((kdf, cost), salt)
+
+    def salt(self, kdf, cost):
+        with self.lock:
+            return self.salts.get((kdf, cost))
+
+    def clear(self):
+        with self.lock:
+            self.keys.clear()
+            self.salts.clear()
+
+
+def encrypt(data, password, kdf=None, cost=None, keys=None):
+    """
+    Encrypt bytes with AES-GCM under a key derived from the password.
+    :param data: plaintext bytes
+    :param password: password
+    :param kdf: KDF_PBKDF2 or KDF_SCRYPT, DEFAULT_KDF when not given
+    :param cost: KDF cost, the default for the KDF when not given
+    :param keys: KeyCache of the password, a new key is derived every time when not given
+    :return: encrypted bytes
+    """
+    if kdf is None:
+        kdf = DEFAULT_KDF
+    if cost is None:
+        cost = default_cost(kdf)
+    check_cost(kdf, cost)
+
+    salt = keys.salt(kdf, cost) if keys is not None else None
+    if salt is None:
+        salt = os.urandom(16)
+        key = derive_key(password, kdf, cost, salt)
+        if keys is not None:
+            keys.add(kdf, cost, salt, key)
+    else:
+        key = keys.get(kdf, cost, salt)
+
+    header = json.dumps({"kdf": kdf, "cost": cost, "salt": salt.hex()}).encode()
+    nonce = os.urandom(12)
+    prefix = MAGIC + struct.pack(">H", len(header)) + header
+    return prefix + nonce + AESGCM(key).encrypt(nonce, data, prefix)
+
+
+def decrypt(data, password, keys=None):
+    """
+    Decrypt bytes written by encrypt, or by pyAesCrypt before this module existed.
+    Raises ValueError when the password is wrong, the same as pyAesCrypt.
+    :param data: encrypted bytes
+    :param password: password
+    :param keys: KeyCache of the password, the key is derived every time when not given
+    :return: plaintext bytes
+    """
+    if not data.startswith(MAGIC):
+        out = io.BytesIO()
+        pyAesCrypt.decryptStream(io.BytesIO(data), out, password)
+        return out.getvalue()
+
+    length = struct.unpack(">H", data[len(MAGIC):len(MAGIC) + 2])[0]
+    start = len(MAGIC) + 2
+    header = json.loads(data[start:start + length].decode())
+    prefix = data[:start + length]
+    nonce = data[start + length:start + length + 12]
+
+    try:
+        salt = bytes.fromhex(header["salt"])
+        check_cost(header["kdf"], header["cost"])
+    except (KeyError, TypeError):
+        raise ValueError("File is corrupted.")
+    key = keys.get(header["kdf"], header["cost"], salt) if keys is not None else None
+    if key is None:
+        key = derive_key(password, header["kdf"], header["cost"], salt)
+    try:
+        plaintext = AESGCM(key).decrypt(nonce, data[start + length + 12:], prefix)
+    except InvalidTag:
+        raise ValueError("Wrong password (or file is corrupted).")
+
+    # The key worked, keep it and encrypt with the same salt from now on.
+    if keys is not None:
+        keys.add(header["kdf"], header["cost"], salt, key)
+    return plaintext
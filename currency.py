@@ -0,0 +1,119 @@
+import numpy
+import pandas
+
+# Lightspeed stores currency to thousandths of a cent.
+PLACES = 5
+SCALE = 10 ** PLACES
+
+
+class Currency:
+    """
+    Exact currency amount held as an integer count of thousandths of a cent.
+    """
+
+    def __init__(self, units=0):
+        self.units = int(units)
+
+    @classmethod
+    def parse(cls, value):
+        """
+        Create a Currency from a Lightspeed decimal string.
+        :param value: string such as "-12.50"
+        :return: Currency
+        """
+        fixed = parse(pandas.Series([value]))[0]
+        if pandas.isna(fixed):
+            raise ValueError("Invalid currency value: %s" % value)
+        return cls(fixed)
+
+    def __neg__(self):
+        return Currency(-self.units)
+
+    def __eq__(self, other):
+        return isinstance(other, Currency) and self.units == other.units
+
+    def __hash__(self):
+        return hash(self.units)
+
+    def __repr__(self):
+        return "Currency(%d)" % self.units
+
+
+def parse(values, places=PLACES):
+    """
+    Parse decimal strings into integers scaled by 10 ** places without going through float.
+    :param values: Series of decimal strings such as "-12.50"
+    :param places: number of decimal places to keep
+    :return: Series of scaled integers, NaN where a value is missing or could not be parsed
+    """
+    s = values.astype(str).str.strip()
+    # An optional sign, then digits with an optional fraction, or only a fraction such as ".5".
+    valid = values.notna() & s.str.fullmatch(r'[+-]?(\d+(\.\d*)?|\.\d+)')
+    negative = s.str.startswith('-')
+    parts = s.str.lstrip('+-').str.split('.', n=1, expand=True).reindex(columns=[0, 1])
+    whole = pandas.to_numeric(parts[0].fillna('').astype(str).replace('', '0'), errors='coerce')
+    frac = pandas.to_numeric(parts[1].fillna('').astype(str).str.ljust(places, '0').str[:places], errors='coerce')
+    fixed = whole * (10 ** places) + frac
+    return fixed.where(~negative, -fixed).where(valid)
+
+
+def div_round_half_up(numerator, denominator):
+    """
+    Integer division rounding halves away from zero, same as Decimal ROUND_HALF_UP.
+    Works on ints and on int64 arrays or Series.
+    :param numerator: dividend
+    :param denominator: divisor, never zero
+    :return: quotient
+    """
+    sign = numpy.sign(numerator) * numpy.sign(denominator)
+    numerator = numpy.abs(numerator)
+    denominator = numpy.abs(denominator)
+    return sign * ((numerator * 2 + denominator) // (denominator * 2))
+
+
+def round_half_up(values, places=2):
+    """
+    Round amounts held in thousandths of a cent half up.
+    :param values: int64 Series in thousandths of a cent
+    :param places: decimal places to keep
+    :return: int64 Series scaled by 10 ** places
+    """
+    return div_round_half_up(values, 10 ** (PLACES - places))
+
+
+def to_string(values, places=2, min_places=None):
+    """
+    Format scaled integers as decimal strings.
+    :param values: int64 Series scaled by 10 ** places
+    :param places: number of decimal places in values
+    :param min_places: drop trailing zeros down to this many decimal places, such as "2.01000" to "2.01"
+    :return: Series of strings such as "-12.50"
+    """
+    scale = 10 ** places
+    magnitude = numpy.abs(values)
+    fraction = (magnitude % scale).astype(str).str.zfill(places)
+    if min_places is not None and min_places < places:
+        fraction = fraction.str[:min_places] + fraction.str[min_places:].str.rstrip('0')
+    text = (magnitude // scale).astype(str) + '.' + fraction
+    return text.where(values >= 0, '-' + text)
+
+
+def reconcile(values, groups, places=2):
+    """
+    Round line amounts so that each group of lines adds up to its rounded group total.
+    The rounding residue of a group is given out one unit at a time to the lines whose
+    rounding moved them furthest from their exact amount.
+    :param values: int64 Series of line amounts in thousandths of a cent
+    :param groups: Series of group keys, usually saleID
+    :param places: decimal places to keep
+    :return: int64 Series scaled by 10 ** places
+    """
+    rounded = round_half_up(values, places)
+    remainder = values - rounded * (10 ** (PLACES - places))
+
+    target = round_half_up(values.groupby(groups).transform('sum'), places)
+    residue = target - rounded.groupby(groups).transform('sum')
+    direction = numpy.sign(residue)
+
+    order = (remainder * direction).groupby(groups).rank(method='first', ascending=False)
+    return rounded + direction * (order <= numpy.abs(residue)).astype('int64')
@@ -0,0 +1,684 @@
+import datetime
+import contextlib
+import tokens
+import sessions
+import reference
+import warehouse
+import clearing
+import balances
+import writers
+import lsapi
+
+# Export shop selection that exports every shop in one pass
+ALL_SHOPS = "All Shops"
+
+# Reference data a job needs before it can run
+REFERENCE_SOURCES = ["CustomerType", "PaymentType", "Customer/CustomField", "Shop", "Employee"]
+
+
+def vc_config(settings):
+    """
+    Veracross client config for a settings profile, with the scopes the connector needs.
+    :param settings: settings profile
+    :return: dictionary for the Veracross client
+    """
+    return {
+        'scopes': [
+            "students:read",
+            "students:list",
+            "staff_faculty:read",
+            "staff_faculty:list",
+            "households:list",
+            "households:read"
+        ],
+        'client_id': settings["vc_client"],
+        'client_secret': settings["vc_secret"],
+        'school': settings["vc_school"]
+    }
+
+
+def customer_type_ids(records):
+    return {i["name"]: i["customerTypeID"] for i in records}
+
+
+def payment_type_ids(records):
+    return {i["name"]: i["paymentTypeID"] for i in records}
+
+
+def shops_by_name(records):
+    return {s["name"]: s for s in records}
+
+
+def employees_by_name(records):
+    return {s["firstName"] + " " + s["lastName"] + " ID:" + s["employeeID"]: s for s in records}
+
+
+def custom_field_id(records, name):
+    """
+    Lightspeed id of the custom field with a name.
+    :param records: CustomField records
+    :param name: field name from the import options
+    :return: customFieldID, or None when there is no such field
+    """
+    for cf in records:
+        if str(cf["name"]) == str(name):
+            return cf["customFieldID"]
+    return None
+
+
+class Job:
+    """
+    Sync and export work for one settings profile. Holds its own clients and reference data, so jobs
+    for several profiles can run side by side in the window or in separate processes.
+    """
+
+    def __init__(self, settings, ls, vc, log, reference_cache=None, sales_warehouse=None, clearing_engine=None):
+        self.settings = settings
+        self.ls = ls
+        self.vc = vc
+        self.log = log
+        self.reference = reference_cache
+        self.warehouse = sales_warehouse
+        self.clearing = clearing_engine
+
+        self.ls_customer_types = dict()
+        self.ls_payment_types = dict()
+        self.ls_shops = dict()
+        self.ls_employee = dict()
+        self.veracrossid_field = None
+        self.lastsync_field = None
+
+    @classmethod
+    def from_settings(cls, settings, password, log, profile=None):
+        """
+        Job with new clients and local stores for a settings profile.
+        :param settings: settings profile
+        :param password: settings password, used for the access token cache
+        :param log: method taking text and level, like Main.debug_append_log
+        :param profile: profile name, which keeps the profile's access tokens and local stores apart
+        :return: Job
+        """
+        token_cache = tokens.TokenCache(tokens.default_path(profile), password, log)
+        vc = tokens.VeracrossClient(vc_config(settings), token_cache=token_cache)
+        sessions.attach(vc)
+        ls = tokens.LightspeedClient(settings, token_cache=token_cache)
+        sessions.attach(ls)
+
+        account_id = settings["account_id"]
+        return cls(settings, ls, vc, log,
+                   reference_cache=reference.ReferenceCache(reference.default_path(account_id, profile)),
+                   sales_warehouse=warehouse.SalesWarehouse(warehouse.default_path(account_id, profile)),
+                   clearing_engine=clearing.ClearingEngine(ls, clearing.default_path(account_id, profile), log=log))
+
+    def reference_records(self, source):
+        """
+        Lightspeed reference data, from the cache while it is fresh.
+        Cached data is used when Lightspeed cannot be reached.
+        :param source: Lightspeed source such as Shop
+        :return: list of records
+        """
+        if self.reference is None:
+            return lsapi.get_records(self.ls, source)
+
+        records = self.reference.get(source)
+        if records is not None and self.reference.is_fresh(source):
+            return records
+        try:
+            return self.reference.refresh(self.ls, source)
+        except Exception as e:
+            if records is None:
+                raise
+            self.log("Unable to get %s data from Lightspeed, using cached data. %s" % (source, e), "debug")
+            return records
+
+    def load_reference(self):
+        """
+        Load the customer types, payment types, custom fields, shops and employees the jobs need.
+        :return:
+        """
+        records = dict((source, self.reference_records(source)) for source in REFERENCE_SOURCES)
+        self.ls_customer_types = customer_type_ids(records["CustomerType"])
+        self.ls_payment_types = payment_type_ids(records["PaymentType"])
+        self.ls_shops = shops_by_name(records["Shop"])
+        self.ls_employee = employees_by_name(records["Employee"])
+        self.veracrossid_field = custom_field_id(records["Customer/CustomField"],
+                                                 self.settings.get("import_options_veracrossid"))
+        self.lastsync_field = custom_field_id(records["Customer/CustomField"],
+                                              self.settings.get("import_options_lastsync"))
+
+        if self.veracrossid_field is None:
+            self.log("Unable to find Lightspeed custom import field for VeracrossID.", "window,info")
+        if self.lastsync_field is None:
+            self.log("Unable to find Lightspeed custom import field for LastSync.", "window,info")
+
+    def sync_customers(self, options):
+        """
+        Create or update Lightspeed customers from Veracross.
+        :param options: user_type Students or Faculty Staff, grade_level, force_sync, and updated_after date or None
+        :return:
+        """
+        param = {}
+        grade_level = options.get('grade_level', "None")
+        # Make sure we have a lastsync and veracross id field mapped.
+        if self.veracrossid_field is None or self.lastsync_field is None:
+            self.log("Enter valid map fields for VeracrossID and LastSync first.", "window,info")
+            return None
+
+        # Determine if we are syncing VC changes after particular date and update params set to VC.
+        if options.get('updated_after'):
+            param.update({"on_or_after_last_modified_date": str(options['updated_after'])})
+
+        # If we are working with students, add additional parameters.
+        if options.get('user_type') == "Students":
+            self.log("Getting Veracross Students (Current)", "window,info")
+
+            # Add a grade level filter
+            ## TODO: This no longer is a query parameter in VC API3... Will need to filter after pulling entire set.
+            if not grade_level == "None":
+                if "Other" in grade_level:
+                    # Append non-standard grades to the grade_level param. 20-30
+                    param.update({"grade_level": ",".join(str(x) for x in list(range(20, 30)))})
+                else:
+                    param.update({"grade_level": grade_level})
+
+            # Limit to only current students
+            # deprecated in VCAPI3 param.update({"option": "2"})
+
+            # Show our parameters to debug log
+            self.log("VC Parameters: " + str(param), "debug")
+
+            # Get Veracross data for students
+            if len(param) > 0:
+                vcdata = self.vc.pull("students", parameters=param)
+            else:
+                vcdata = self.vc.pull("students")
+
+            # Get Lightspeed id number that matches customer_type Student
+            try:
+                ls_customerTypeID = self.ls_customer_types["Student"]
+            except:
+                self.log("Unable to get CustomerType of Student from Lightspeed. "
+                         "Check name of CustomerType in Lightspeed.", "window,info")
+
+        # Determine if we want FacultyStaff from VC
+        elif options.get('user_type') == "Faculty Staff":
+            # Let user know whats up
+            self.log("Getting Veracross Faculty Staff (Faculty and Staff)", "window,info")
+            # Limit to roles 1 & 2 in VC Api.
+
+            # deprecated in VC API3.
+            # param.update({"roles": "1,2"})
+
+            # Show parameters to debug log
+            self.log("VC Parameters: " + str(param), "debug")
+
+            # Get Veracross data for Faculty Staff
+            vcdata = self.vc.pull("staff_faculty")
+
+            # Determine what Lightspeed customer id number for FacStaff
+            try:
+                ls_customerTypeID = self.ls_customer_types["FacultyStaff"]
+            except:
+                self.log("Unable to get CustomerType of FacultyStaff from Lightspeed. "
+                         "Check name of CustomerType in Lightspeed.", "window,info")
+
+        # User did not select a user type
+        else:
+            self.log("Select Veracross User Type first.", "window,info")
+            return None
+
+        # Going to use progress bar.  Make sure it is at zero first.
+        # self.ui.progressBar.setValue(0)
+
+        # Determine each increment for progress bar.
+        # increment = 100 / len(vcdata)
+        # total_increment = 0
+
+        # Loop through the data from VC.
+        for i in vcdata:
+
+            # increment the progress bar.
+            # total_increment = total_increment + increment
+            # self.ui.progressBar.setValue(int(total_increment))
+
+            self.log("Processing VC Record {}".format(i["id"]), "debug")
+
+            # Get household data for this person
+            h = self.vc.pull("households/" + str(i["household_id"]))
+
+            # Set search parameters for lightspeed and see if we find someone in LS.
+            lsparam = dict(load_relations='all', limit=1, companyRegistrationNumber=str(i["id"]))
+            check_current = next(lsapi.iter_records(self.ls, "Customer", lsparam), None)
+
+            # Format data to how it should look. First name will format later.
+            vc_formatted = {'Customer':
+                                {'firstName': '',
+                                 'lastName': i["last_name"],
+                                 'companyRegistrationNumber': i["id"],
+                                 'customerTypeID': ls_customerTypeID,
+                                 'Contact': {
+                                     'custom': i["id"],
+                                     'noEmail': 'false',
+                                     'noPhone': 'false',
+                                     'noMail': 'false',
+                                     'Emails': {
+                                         'ContactEmail': {
+                                             'address': i["email_1"],
+                                             'useType': 'Primary'
+                                         }
+                                     },
+                                     'Addresses': {
+                                         'ContactAddress': {
+                                             'address1': h["address_line_1"],
+                                             'address2': h["address_line_2"],
+                                             'city': h["city"],
+                                             'state': h["state_or_province"],
+                                             'zip': h["zip"],
+                                             'country': '',
+                                             'countryCode': '',
+                                             'stateCode': ''
+                                         }
+                                     }
+                                 },
+                                 'CreditAccount': {
+                                     'creditLimit': str(self.settings["import_options_creditamount"]) + '.00'
+                                 },
+                                 'CustomFieldValues': {
+                                     'CustomFieldValue': [{
+                                         'customFieldID': self.veracrossid_field,
+                                         'value': i["id"]
+                                     }, {
+                                         'customFieldID': self.lastsync_field,
+                                         'value': str(datetime.datetime.now())
+                                     }
+                                     ]}
+                                 }
+                            }
+
+            # Update data to use correct nick name format from VC.
+            # Added becuase of bug in VC API where sometimes one is returned over other.
+            if 'preferred_name' in i:
+                if i['preferred_name'] is None:
+                    vc_formatted['Customer']['firstName'] = i['first_name']
+                else:
+                    vc_formatted['Customer']['firstName'] = i['preferred_name']
+            elif 'first_name' in i:
+                vc_formatted['Customer']['firstName'] = i['first_name']
+
+            # Did we find a record in lightspeed to sync to?
+            if check_current:
+
+                # Create two dictionaries one for VC and the other for LS
+                # We will see if they match later.
+                vc_person = dict()
+                ls_customer = dict()
+
+                # Format VC Data for comparison
+                vc_person["personpk"] = str(i["id"])
+                vc_person["last_name"] = i["last_name"]
+                if 'preferred_name' in i:
+                    if i['preferred_name'] is None:
+                        vc_person["first_name"] = i['first_name']
+                    else:
+                        vc_person["first_name"] = i['preferred_name']
+                elif 'first_name' in i:
+                    vc_person["first_name"] = i['first_name']
+
+                # Handle missing email
+                if i["email_1"] is None:
+                    vc_person["email"] = ''
+                else:
+                    vc_person["email"] = i["email_1"]
+
+                vc_person["address_1"] = h["address_line_1"]
+                if h["address_line_2"] is None:
+                    vc_person["address_2"] = ''
+                else:
+                    vc_person["address_2"] = h["address_line_2"]
+                vc_person["city"] = h["city"]
+                vc_person["zip"] = h["zip"]
+                vc_person["state"] = h["state_or_province"]
+
+                # Format LS Data for comparison
+                try:
+                    ls_customer["personpk"] = str(check_current["Contact"]["custom"])
+                except:
+                    ls_customer["personpk"] = ""
+
+                ls_customer["last_name"] = check_current["lastName"]
+                ls_customer["first_name"] = check_current["firstName"]
+
+                # Handle missing email addresses.
+                try:
+                    ls_customer["email"] = check_current["Contact"]["Emails"]["ContactEmail"][0]["address"]
+                except:
+                    ls_customer["email"] = ''
+
+                # Handle missing mailing addresses
+                try:
+                    ls_customer["address_1"] = check_current["Contact"]["Addresses"]["ContactAddress"][0]["address1"]
+                    ls_customer["address_2"] = check_current["Contact"]["Addresses"]["ContactAddress"][0]["address2"]
+                    ls_customer["city"] = check_current["Contact"]["Addresses"]["ContactAddress"][0]["city"]
+                    ls_customer["zip"] = check_current["Contact"]["Addresses"]["ContactAddress"][0]["zip"]
+                    ls_customer["state"] = check_current["Contact"]["Addresses"]["ContactAddress"][0]["state"]
+                except:
+                    ls_customer["address_1"] = ''
+                    ls_customer["address_2"] = ''
+                    ls_customer["city"] = ''
+                    ls_customer["zip"] = ''
+                    ls_customer["state"] = ''
+
+                # Compare the data. Are the two dictionaries the same...
+                if not ls_customer == vc_person or options.get('force_sync', False):
+                    self.log("Updating customer {} {}.".format(vc_formatted['Customer']['firstName'],
+                                                               vc_formatted['Customer']['lastName']),
+                             "info")
+                    vc_formatted['Customer']['customerID'] = check_current['customerID']
+                    self.ls.update("Customer/" + vc_formatted['Customer']['customerID'], vc_formatted["Customer"])
+                else:
+                    self.log(
+                        "Record {} {} already up to date.".format(vc_formatted['Customer']['firstName'],
+                                                                  vc_formatted['Customer']['lastName']),
+                        "info")
+            else:
+                # Add new user when not found in LS
+                self.log("Adding new Lightspeed Customer for {} {}".format(
+                    vc_formatted['Customer']['firstName'],
+                    vc_formatted['Customer']['lastName']),
+                    "info")
+                try:
+                    new_customer = self.ls.create("Customer", vc_formatted["Customer"])
+                    self.log(
+                        "New Customer # {} Added: {} {}".format(new_customer['Customer']['customerID'],
+                                                                new_customer['Customer']['firstName'],
+                                                                new_customer['Customer']['lastName']),
+                        "info")
+                except:
+                    self.log("Unable to add new Lightspeed Customer for {} {}".format(
+                        vc_formatted['Customer']['firstName'],
+                        vc_formatted['Customer']['lastName']),
+                        "info")
+
+    def export_charges(self, options):
+        """
+        Export Charges from LS in CSV
+        :param options: shop, customer_types, begin_date, end_date, export_folder, file_format, the
+                        export_options columns, reconcile, debug, and clear_charges with payment_type and employee
+        :return:
+        """
+        # pandas is only loaded once an export starts.
+        import sales
+
+        # Warn about debugging
+        debug = options.get('debug', False)
+        if debug:
+            self.log("Export debugging enabled.", "window,info")
+
+        # Shops to export. All Shops exports every shop from a single pass over the sales.
+        shop = str(options['shop'])
+        if shop == ALL_SHOPS:
+            export_shops = list(self.ls_shops.keys())
+        else:
+            export_shops = [shop]
+
+        # Set Timezone and id for each shop
+        shop_offsets = dict()
+        shop_ids = dict()
+        for name in export_shops:
+            shop_offsets[name] = self.shop_utc_offset(name)
+            shop_ids[name] = self.ls_shops[name]['shopID']
+            self.log("Filtering results to shop %s, id %s" % (name, shop_ids[name]), "debug")
+
+        # Customer Types. Every chosen type is exported from a single fetch and balance scan, and
+        # only the balances of the chosen types are cleared.
+        export_types = [str(t) for t in options.get('customer_types') or []]
+        if not export_types:
+            self.log("Select at least one customer type to export.", "window,info")
+            return None
+
+        type_ids = dict()
+        for name in export_types:
+            type_ids[name] = self.ls_customer_types[name]
+            self.log("Filtering results to customerType %s, id %s" % (name, type_ids[name]), "debug")
+
+        # Only one type can be filtered by the warehouse query.
+        if len(export_types) == 1:
+            ct_id = type_ids[export_types[0]]
+        else:
+            ct_id = None
+
+        if options.get('clear_charges', False):
+            pt = str(options['payment_type'])
+            pt_id = self.ls_payment_types[pt]
+
+        # Ensure there is an export location
+        if not options.get('export_folder'):
+            self.log("Missing export folder location.", "window,info")
+            return None
+
+        # Notify UI
+        self.log("Export started for customer types: " + ", ".join(export_types), "window,info")
+
+        # !! Sale Line Export !!
+
+        # Export SaleLine Data
+        begin_date = options['begin_date']
+        end_date = options['end_date']
+
+        if len(str(begin_date)) != 10 or len(str(end_date)) != 10:
+            self.log("Invalid begin or end date.", "info")
+            self.log(str(begin_date), "info")
+            return None
+
+        try:
+            # Fetch the sales of the export range the local sales warehouse does not hold yet. One shop
+            # is fetched on its own, all shops together once per timezone.
+            if len(export_shops) == 1:
+                fetched = self.warehouse.sync(self.ls, begin_date, end_date, shop_offsets[shop],
+                                              shop_id=shop_ids[shop], customer_type_id=ct_id)
+            else:
+                fetched = 0
+                for offset in sorted(set(shop_offsets.values())):
+                    fetched += self.warehouse.sync(self.ls, begin_date, end_date, offset, customer_type_id=ct_id)
+            self.log("Fetched %s sales from Lightspeed." % fetched, "window,info")
+
+            # Then query the export range from it. All shops are read in one pass over a range
+            # wide enough for every timezone, and split per shop below.
+            if len(export_shops) == 1:
+                salelines = self.warehouse.sales(begin_date,
+                                                 end_date,
+                                                 shop_offsets[shop],
+                                                 shop_id=shop_ids[shop],
+                                                 customer_type_id=ct_id)
+            else:
+                salelines = self.warehouse.sales(begin_date - datetime.timedelta(days=1),
+                                                 end_date + datetime.timedelta(days=1),
+                                                 "+00:00",
+                                                 customer_type_id=ct_id)
+        except Exception as error:
+            self.log("Unable to get SaleLine data.", "window,info")
+            self.log(str(error), "debug")
+            return None
+
+        # Flatten sale lines into columns and compute the export values a chunk of sales at a time.
+        export_options = {
+            'transaction_source': options.get('transaction_source', ''),
+            'transaction_type': options.get('transaction_type', ''),
+            'school_year': options.get('school_year', ''),
+            'catalog_item_fk': options.get('catalog_item_fk', '')
+        }
+
+        # Optionally round line amounts so they add up to the rounded invoice totals.
+        reconcile = options.get('reconcile', False)
+        file_format = options.get('file_format', 'csv').lower()
+
+        try:
+            # Rows are written as they are produced and each file is moved into place when complete.
+            # One file per shop and customer type.
+            with contextlib.ExitStack() as stack:
+                saleline_writers = dict()
+                for name in export_shops:
+                    for type_name in export_types:
+                        filename = str(options['export_folder'])
+                        filename = filename + '/' + self.export_file_prefix(name, type_name, export_types) + \
+                                   '_Lightspeed_Salelines_Export_' + datetime.datetime.now().strftime('%m%d%Y-%H%M%S')
+                        self.log(str(filename), "info")
+                        saleline_writers[(name, type_name)] = stack.enter_context(
+                            writers.open_writer(file_format, filename, sales.saleline_export_columns(debug)))
+
+                for chunk in sales.chunks(self.on_account_sales(salelines, list(shop_ids.values()),
+                                                                list(type_ids.values()))):
+                    lines = sales.saleline_frame(chunk)
+
+                    for name in export_shops:
+                        shop_lines = sales.shop_window_lines(lines, shop_ids[name], begin_date, end_date,
+                                                             shop_offsets[name])
+                        for type_name in export_types:
+                            type_lines = shop_lines[shop_lines['sale.Customer.customerTypeID'].astype(str) ==
+                                                    str(type_ids[type_name])]
+                            saleline_export_data, failed = sales.saleline_export_frame(type_lines,
+                                                                                       shop_ids[name],
+                                                                                       export_options,
+                                                                                       debug=debug,
+                                                                                       reconcile=reconcile)
+                            saleline_writers[(name, type_name)].write_frame(saleline_export_data)
+
+                            for index, s in failed.iterrows():
+                                self.log("Unable to append item %s for Sale %s data to export." %
+                                         (str(s['saleLineID']), str(s['sale.saleID'])), "info")
+                                self.log("Debug Output: " + str(s.to_dict()), "debug")
+        except Exception as error:
+            self.log("Failed to format SaleLine data.", "window,info")
+            self.log(str(error), "debug")
+            return None
+
+        # !! Account Balance Export !!
+        if options.get('clear_charges', False):
+            # Finish clears left over from an interrupted export before reading balances again.
+            cleared, failed = self.clearing.run()
+            if cleared or failed:
+                self.log("Finished %s clears from an earlier export, %s failed." % (cleared, failed),
+                         "window,info")
+        elif self.clearing.unfinished():
+            self.log("An earlier export has unfinished clears. "
+                     "Enable clearing charges to finish them.", "window,info")
+
+        # Get Customers with Balance on account. Used to export balances and clear accounts.
+        # Only customers of the selected types that owe a balance are requested, one page at a time.
+        customers = balances.customers_with_balance(self.ls, list(type_ids.values()))
+
+        # One balance file per customer type.
+        balance_files = dict()
+        clear_accounts = dict()
+
+        try:
+            f = ['first_name',
+                 'last_name',
+                 'veracross_id',
+                 'lightspeed_cust_type',
+                 'balance',
+                 'lightspeed_cust_num']
+
+            with contextlib.ExitStack() as stack:
+                balance_writers = dict()
+                for type_name in export_types:
+                    filename = str(options['export_folder'])
+                    filename = filename + '/' + self.export_file_prefix(shop, type_name, export_types) + \
+                               '_Lightspeed_Balance_Export_' + datetime.datetime.now().strftime('%m%d%Y-%H%M%S')
+                    balance_writers[str(type_ids[type_name])] = stack.enter_context(
+                        writers.open_writer(file_format, filename, f))
+                    clear_accounts[str(type_ids[type_name])] = []
+
+                for i in customers:
+                    a = [i['firstName'],
+                         i['lastName'],
+                         i['companyRegistrationNumber'],
+                         i['customerTypeID'],
+                         i['CreditAccount']['balance'],
+                         i['customerID']]
+                    balance_writers[str(i['customerTypeID'])].write_rows([a])
+                    clear_accounts[str(i['customerTypeID'])].append(i)
+
+            for type_id, writer in balance_writers.items():
+                balance_files[type_id] = writer.path
+        except Exception as error:
+            self.log("Failed to export balance data.", "window,info")
+            self.log(str(error), "debug")
+            return None
+
+        if options.get('clear_charges', False):
+            selected_emp = options['employee']
+            emp_id = selected_emp.split("ID:", 1)[1]
+
+            # Write every clear to the ledger before any are sent, then clear the balances.
+            for type_id, filename in balance_files.items():
+                batch = clearing.new_batch()
+                for i in clear_accounts[type_id]:
+                    self.clearing.record(batch,
+                                         int(i['customerID']),
+                                         int(i["creditAccountID"]),
+                                         i['CreditAccount']['balance'],
+                                         int(pt_id),
+                                         int(emp_id),
+                                         file=filename)
+
+                cleared, failed = self.clearing.run(batch)
+                self.log("Cleared %s balances, %s failed." % (cleared, failed), "window,info")
+
+        # Finish of progress bar
+        # self.ui.progressBar.setValue(int(100))
+
+    def shop_utc_offset(self, shop):
+        """
+        Current utc offset of a shop's timezone.
+        :param shop: shop name
+        :return: offset formatted as -04:00
+        """
+        import pytz
+
+        shop_timezone_name = self.ls_shops[shop]["timeZone"]
+        timezone = pytz.timezone(shop_timezone_name)
+        shop_timezone_utc_offset = datetime.datetime.now(timezone).strftime('%z')
+        self.log(
+            "Found %s timezone for shop named %s." % (shop_timezone_name, self.ls_shops[shop]["name"]),
+            "window,info")
+        return shop_timezone_utc_offset[:3] + ":" + shop_timezone_utc_offset[3:]
+
+    def export_file_prefix(self, shop, customer_type, export_types):
+        """
+        Start of an export file name. The customer type is only added when exporting several types.
+        :param shop: shop name
+        :param customer_type: customer type name
+        :param export_types: customer type names being exported
+        :return: file name prefix
+        """
+        if len(export_types) > 1:
+            return f'{shop}_{customer_type}'
+        return f'{shop}'
+
+    def on_account_sales(self, salelines, shop_ids, ct_ids):
+        """
+        Yield the sales paid on account for the shops and customer types being exported.
+        :param salelines: Sale records
+        :param shop_ids: shopIDs being exported
+        :param ct_ids: customerTypeIDs being exported
+        :return: generator of Sale records
+        """
+        import sales
+
+        for i in salelines:
+            # Shop and customer type are checked before the payments, so mixed payment warnings
+            # are only logged for sales being exported.
+            kind = sales.classify_sale(i, shop_ids=shop_ids, customer_type_ids=ct_ids)
+
+            if kind == sales.MIXED:
+                # Skip sales that mix payments with on_account
+                self.log("Skipping Sale #%s (%s %s): Other payments mixed with On Account." %
+                         (str(i['saleID']),
+                          str(i['Customer']['firstName']),
+                          str(i['Customer']['lastName'])),
+                         "info")
+                continue
+
+            if kind == sales.ON_ACCOUNT and 'SaleLines' in i:
+                yield i
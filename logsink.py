@@ -0,0 +1,52 @@
+import collections
+from PyQt5.QtCore import QObject, QTimer
+
+# Longest a log record waits before it is shown. Bursts inside this window are shown together.
+FLUSH_INTERVAL_MS = 100
+
+
+class LogSink(QObject):
+    """
+    Log records queued from any thread and passed to the window in batches on a GUI thread timer,
+    so a busy worker causes at most one widget update per interval.
+    """
+
+    def __init__(self, flush, interval=FLUSH_INTERVAL_MS, parent=None):
+        """
+        Create in the GUI thread.
+        :param flush: method taking a list of (text, level) records, called in the GUI thread
+        :param interval: milliseconds between flushes
+        :param parent: owning QObject
+        """
+        super().__init__(parent)
+        self.flush = flush
+        # Appending and popping from either end of a deque is thread-safe.
+        self.records = collections.deque()
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush_pending)
+        self.timer.start()
+
+    def put(self, text, level):
+        """
+        Queue a record. Safe to call from any thread.
+        :param text: log text
+        :param level: log level such as window,info
+        :return:
+        """
+        self.records.append((text, level))
+
+    def flush_pending(self):
+        """
+        Pass every queued record to flush in one batch.
+        :return:
+        """
+        batch = []
+        while True:
+            try:
+                batch.append(self.records.popleft())
+            except IndexError:
+                break
+        if batch:
+            self.flush(batch)
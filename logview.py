@@ -0,0 +1,107 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSortFilterProxyModel
+
+# Most records the log window keeps. The oldest are dropped first, the log file keeps everything.
+LOG_CAPACITY = 10000
+
+# Level filter choices, matched against the record level such as window,info. All shows everything.
+LOG_LEVEL_ALL = "All"
+
+# Role returning the level of a record
+LevelRole = Qt.UserRole + 1
+
+
+class LogModel(QAbstractListModel):
+    """
+    Log records in a fixed size ring buffer. Appending is constant time and memory stays bounded
+    however long the window is open.
+    """
+
+    def __init__(self, capacity=LOG_CAPACITY, parent=None):
+        super().__init__(parent)
+        self.capacity = capacity
+        self.buffer = [None] * capacity
+        # Index of the oldest record and number of records held
+        self.start = 0
+        self.count = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.count
+
+    def record(self, row):
+        return self.buffer[(self.start + row) % self.capacity]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.count:
+            return None
+        text, level = self.record(index.row())
+        if role == Qt.DisplayRole:
+            return text
+        if role == LevelRole:
+            return level
+        return None
+
+    def append_records(self, records):
+        """
+        Add records to the end, dropping the oldest once the buffer is full.
+        :param records: list of text and level
+        :return:
+        """
+        # Anything can be logged, e.g. a release body that is None, but the view and filter need text.
+        records = [(str(text), level) for text, level in list(records)[-self.capacity:]]
+        if not records:
+            return
+
+        overflow = self.count + len(records) - self.capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for row in range(overflow):
+                self.buffer[(self.start + row) % self.capacity] = None
+            self.start = (self.start + overflow) % self.capacity
+            self.count -= overflow
+            self.endRemoveRows()
+
+        self.beginInsertRows(QModelIndex(), self.count, self.count + len(records) - 1)
+        for record in records:
+            self.buffer[(self.start + self.count) % self.capacity] = record
+            self.count += 1
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.buffer = [None] * self.capacity
+        self.start = 0
+        self.count = 0
+        self.endResetModel()
+
+
+class LogFilter(QSortFilterProxyModel):
+    """
+    Shows the log records matching a level and search text.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.level = LOG_LEVEL_ALL
+        self.search = ""
+
+    def set_filter(self, level, search):
+        """
+        Show only records of a level that contain the search text, ignoring case.
+        :param level: level name such as Info, or LOG_LEVEL_ALL
+        :param search: search text, empty matches every record
+        :return:
+        """
+        self.level = level
+        self.search = search.lower()
+        self.invalidateFilter()
+
+    def active(self):
+        return self.level != LOG_LEVEL_ALL or bool(self.search)
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        text, level = self.sourceModel().record(source_row)
+        if self.level != LOG_LEVEL_ALL and self.level.lower() not in level:
+            return False
+        return not self.search or self.search in text.lower()
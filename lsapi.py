@@ -0,0 +1,249 @@
+import time
+import threading
+import ijson
+import requests
+from urllib import parse
+
+# Lightspeed API request retries when the rate limit bucket is full.
+RATE_LIMIT_RETRIES = 3
+
+# Seconds to wait for Lightspeed to accept a connection and to send the response.
+REQUEST_TIMEOUT = (10, 120)
+
+# Size of the Lightspeed rate limit bucket until a response reports it.
+BUCKET_SIZE = 60
+
+_limiters_lock = threading.Lock()
+
+# Lightspeed returns a dict for one record and a list for several. The records held under these
+# relation containers are always made lists, at any depth, such as Sale SaleLines.SaleLine or
+# Customer Contact.Emails.ContactEmail. Records of a source, such as Shop, Employee or CustomField,
+# are made a list by iter_records.
+PLURAL_RELATIONS = {
+    'SaleLines': 'SaleLine',
+    'SalePayments': 'SalePayment',
+    'CustomFieldValues': 'CustomFieldValue',
+    'Emails': 'ContactEmail',
+    'Phones': 'ContactPhone',
+    'Addresses': 'ContactAddress'
+}
+
+
+def as_list(value):
+    """
+    One or many Lightspeed records as a list.
+    :param value: dict, list, or empty value
+    :return: list of records
+    """
+    if not value:
+        return []
+    if isinstance(value, dict):
+        return [value]
+    return value
+
+
+def normalize_record(record):
+    """
+    Make the plural relations of a record and its related records lists, in place.
+    :param record: record from Lightspeed
+    :return: the same record
+    """
+    for name, value in record.items():
+        if name in PLURAL_RELATIONS:
+            key = PLURAL_RELATIONS[name]
+            if isinstance(value, dict):
+                value[key] = as_list(value.get(key))
+                for i in value[key]:
+                    normalize_record(i)
+            else:
+                record[name] = {key: []}
+        elif isinstance(value, dict):
+            normalize_record(value)
+    return record
+
+
+class RateLimiter:
+    """
+    Client-side copy of the Lightspeed leaky bucket, shared by every thread using a client.
+    Units are reserved before a request is sent, so concurrent requests cannot overfill the bucket.
+    """
+
+    def __init__(self, size=BUCKET_SIZE, rate=1):
+        self.size = float(size)
+        self.rate = float(rate)
+        self.level = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def drain(self):
+        now = time.monotonic()
+        self.level = max(0.0, self.level - (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, units=1):
+        """
+        Wait until the bucket has room and reserve it. Threads wait their turn.
+        :param units: 1 for a GET, 10 for a POST, PUT or DELETE
+        :return: nothing
+        """
+        with self.lock:
+            self.drain()
+            if self.level + units > self.size:
+                time.sleep((self.level + units - self.size) / self.rate)
+                self.drain()
+            self.level += units
+
+    def update(self, headers):
+        """
+        Catch up with the bucket level Lightspeed reported. The higher level wins, as ours also
+        counts requests still in flight.
+        :param headers: response headers
+        :return: nothing
+        """
+        if 'X-LS-API-Bucket-Level' not in headers:
+            return
+        level, size = headers['X-LS-API-Bucket-Level'].split("/")
+        with self.lock:
+            self.drain()
+            self.level = max(self.level, float(level))
+            self.size = float(size)
+            self.rate = float(headers.get('X-LS-API-Drip-Rate', self.rate))
+
+    def full(self):
+        """
+        Treat the bucket as full, after Lightspeed answered too many requests.
+        :return: nothing
+        """
+        with self.lock:
+            self.drain()
+            self.level = self.size
+
+
+def rate_limiter(ls):
+    """
+    Rate limiter of a Lightspeed client, added the first time it is needed.
+    :param ls: Lightspeed API client
+    :return: RateLimiter
+    """
+    with _limiters_lock:
+        if getattr(ls, 'rate_limiter', None) is None:
+            ls.rate_limiter = RateLimiter()
+        return ls.rate_limiter
+
+
+def send(ls, method, url, data=None, stream=False):
+    """
+    Send one request through the client's rate limiter, retrying when Lightspeed answers 429, times out
+    or can not be reached. A post is only sent again when it never connected.
+    :param ls: Lightspeed API client
+    :param method: get, post, put or delete
+    :param url: complete api url
+    :param data: post/put data
+    :param stream: leave the body unread
+    :return: requests Response
+    """
+    limiter = rate_limiter(ls)
+    units = 10 if method in ("post", "put", "delete") else 1
+
+    tries = 0
+    while True:
+        limiter.acquire(units)
+        try:
+            response = ls.session.request(method, url, data=data, stream=stream, timeout=REQUEST_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            # Only a post that never connected is certain not to have been created.
+            retry = method != "post" or isinstance(e, requests.exceptions.ConnectTimeout)
+            if not retry or tries >= RATE_LIMIT_RETRIES:
+                raise
+            tries += 1
+            continue
+        limiter.update(response.headers)
+        # Watch for too many requests status
+        if response.status_code == 429 and tries < RATE_LIMIT_RETRIES:
+            response.close()
+            limiter.full()
+            tries += 1
+        else:
+            return response
+
+
+def open_page(ls, url):
+    """
+    Start a GET of one page of results without reading the body.
+    :param ls: Lightspeed API client
+    :param url: complete api url
+    :return: streaming requests Response, close when done
+    """
+    response = send(ls, "get", url, stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise ValueError("Lightspeed returned status %s for %s." % (response.status_code, url))
+
+    # Let urllib3 undo gzip so the decoder reads plain JSON.
+    response.raw.decode_content = True
+    return response
+
+
+def decode_records(stream, key, attributes):
+    """
+    Decode the records of one page as they arrive, so only one record is held in memory at a time.
+    :param stream: file like response body
+    :param key: record key, such as Sale
+    :param attributes: dictionary filled with the page @attributes, such as next
+    :return: generator of records, plural relations always lists
+    """
+    builder = None
+    record_prefix = None
+
+    for prefix, event, value in ijson.parse(stream, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == record_prefix and event == 'end_map':
+                yield normalize_record(builder.value)
+                builder = None
+        elif event == 'start_map' and prefix in (key, key + '.item'):
+            # One record is an object under the key, several are an array of objects.
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+            record_prefix = prefix
+        elif prefix.startswith('@attributes.') and event in ('string', 'number', 'null'):
+            attributes[prefix.split('.', 1)[1]] = value
+
+
+def iter_records(ls, source, parameters=None):
+    """
+    Stream records from the Lightspeed API instead of merging every page first.
+    Each record is yielded as soon as it is decoded from the response.
+    :param ls: Lightspeed API client
+    :param source: API Source desired, such as Customer
+    :param parameters: Optional URL Parameters.
+    :return: generator of records, plural relations always lists
+    """
+    # Check the bearer token is up to date.
+    ls.get_token()
+
+    if parameters:
+        url = ls.api_url + source + ".json?" + parse.urlencode(parameters, safe=':-')
+    else:
+        url = ls.api_url + source + ".json"
+
+    # Records are keyed by the last part of the source, Customer/CustomField returns CustomField.
+    key = source.split("/")[-1]
+
+    while url:
+        attributes = dict()
+        with open_page(ls, url) as response:
+            for i in decode_records(response.raw, key, attributes):
+                yield i
+        url = attributes.get('next')
+
+
+def get_records(ls, source, parameters=None):
+    """
+    Every record from the Lightspeed API as a list, even when there is only one.
+    :param ls: Lightspeed API client
+    :param source: API Source desired, such as Shop
+    :param parameters: Optional URL Parameters.
+    :return: list of records
+    """
+    return list(iter_records(ls, source, parameters=parameters))
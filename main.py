@@ -1,24 +1,36 @@
+import time
+
+# Startup timing report
+STARTUP_BEGIN = time.perf_counter()
+
 import traceback
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
-from PyQt5.QtWebEngineCore import QWebEngineUrlRequestInterceptor
-from PyQt5.QtWebEngineWidgets import QWebEnginePage, QWebEngineView
 from mainwindow import Ui_MainWindow
-import veracross_api3 as veracross
-import lightspeed_api
 import sys
 import os
 import datetime
-import pytz
 import config
-import pandas
-from decimal import Decimal, ROUND_HALF_UP
-import images
 import logging
 import update
+import warehouse
+import clearing
+import lsapi
+import sessions
+import tokens
+import reference
+import jobs
+import logsink
+import logview
 import json
 import subprocess
+import argparse
+
+STARTUP_IMPORTED = time.perf_counter()
+
+# Modules that are only imported when first needed, listed in the startup timing report.
+LAZY_MODULES = ['PyQt5.QtWebEngineWidgets', 'pandas', 'pytz', 'images']
 
 # Set Scaling for High Resolution Displays
 if hasattr(Qt, 'AA_EnableHighDpiScaling'):
@@ -27,6 +39,9 @@ if hasattr(Qt, 'AA_EnableHighDpiScaling'):
 if hasattr(Qt, 'AA_UseHighDpiPixmaps'):
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
 
+# Lets QtWebEngine be imported after the QApplication is created, when authorizing.
+QApplication.setAttribute(Qt.AA_ShareOpenGLContexts, True)
+
 # Setup Logfile
 try:
     logfile = os.environ['TEMP'] + "\\LSVCConnectorLog-" + str(datetime.date.today()) + ".txt"
@@ -71,45 +86,26 @@ class WorkerSignals(QObject):
     progress = pyqtSignal(int)
 
 
-class AuthorizeLS(QMainWindow):
-    def __init__(self, auth_url: object):
-        QMainWindow.__init__(self)
-        self.auth_url = auth_url
-        self.page = QWebEnginePage()
-        self.view = QWebEngineView()
-        self.view.setPage(self.page)
-        self.interceptor = AuthCodeInterceptor()
-        self.page.profile().setRequestInterceptor(self.interceptor)
-        self.view.setUrl(QUrl(self.auth_url))
-        self.view.show()
-
-    def check_code(self):
-        return self.interceptor.code
-
-
-class AuthCodeInterceptor(QWebEngineUrlRequestInterceptor):
-    code_returned = pyqtSignal()
-
-    def __init__(self):
-        super().__init__()
-
-        self.code = ""
-
-    def interceptRequest(self, info):
-        url = info.firstPartyUrl().toString()
-
-        if "localhost" in url:
-            code = url.split("code=")[1]
-            self.code = code
-            self.code_returned.emit()
-
-
 class Main(QMainWindow):
-    def __init__(self):
+    def __init__(self, profile=config.DEFAULT_PROFILE):
         QMainWindow.__init__(self)
+        self.profile = profile
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
+        # Log window records from any thread, shown in batches.
+        self.log_sink = logsink.LogSink(self.show_log_records, parent=self)
+
+        # Log window keeps the latest records only. The filter is used while a level or search is set.
+        self.log_model = logview.LogModel(parent=self)
+        self.log_filter = logview.LogFilter(parent=self)
+        self.ui.list_SyncLog.setModel(self.log_model)
+        self.ui.combo_LogLevel.currentTextChanged.connect(self.filter_log)
+        self.ui.line_LogSearch.textChanged.connect(self.filter_log)
+        self.key_copy_log = QShortcut(QKeySequence.Copy, self.ui.list_SyncLog)
+        self.key_copy_log.setContext(Qt.WidgetShortcut)
+        self.key_copy_log.activated.connect(self.copy_log_selection)
+
         self.threadpool = QThreadPool()
         self.debug_append_log("Multithreading enabled with maximum %d threads." % self.threadpool.maxThreadCount(),
                               "window,info")
@@ -135,47 +131,72 @@ class Main(QMainWindow):
 
         if ok and self.config_passwd:
             try:
-                self.c = config.load_settings("config", self.config_passwd)
+                self.c = config.load_profile(self.profile, self.config_passwd)
             except ValueError:
                 QMessageBox.question(self, 'Incorrect Encryption Password',
                                      "The password provided will not decrypt the settings.",
                                      QMessageBox.Ok)
 
+        try:
+            # Access tokens saved by an earlier run, encrypted with the settings password.
+            self.token_cache = tokens.TokenCache(tokens.default_path(self.profile), self.config_passwd,
+                                                 self.debug_append_log)
+        except:
+            self.token_cache = None
+            self.debug_append_log("Unable to open access token cache.", "window,debug")
+
         try:
             # Initialize Veracross and Lightspeed connection
             # Add needed scopes to VC API
-            self.vc_config = {
-                'scopes': [
-                    "students:read",
-                    "students:list",
-                    "staff_faculty:read",
-                    "staff_faculty:list",
-                    "households:list",
-                    "households:read"
-                ],
-                'client_id': self.c["vc_client"],
-                'client_secret': self.c["vc_secret"],
-                'school': self.c["vc_school"]
-            }
-            self.vc = veracross.Veracross(self.vc_config)
+            self.vc_config = jobs.vc_config(self.c)
+            self.vc = tokens.VeracrossClient(self.vc_config, token_cache=self.token_cache)
+            sessions.attach(self.vc)
         except:
             self.debug_append_log("Unable to connect to Veracross API. Check Settings.", "window,debug")
 
         try:
-            self.ls = lightspeed_api.Lightspeed(self.c)
+            self.ls = tokens.LightspeedClient(self.c, token_cache=self.token_cache)
+            sessions.attach(self.ls)
         except:
             self.debug_append_log("Unable to connect to Lightspeed API. Check Settings.", "window,debug")
 
-        # Images
-        self.ui.lbl_Icon.setPixmap(QPixmap(":/images/icon.png"))
+        try:
+            # Keep access tokens fresh in the background so work never waits on a refresh.
+            self.token_refresher = tokens.TokenRefresher([self.ls, self.vc], self.debug_append_log)
+            self.token_refresher.start()
+        except:
+            self.debug_append_log("Unable to start access token refresh.", "window,debug")
+
+        try:
+            # Ledger of balance clears so interrupted clearing can be finished safely.
+            self.clearing = clearing.ClearingEngine(self.ls,
+                                                    clearing.default_path(self.c["account_id"], self.profile),
+                                                    log=self.debug_append_log)
+        except:
+            self.debug_append_log("Unable to open clearing ledger.", "window,debug")
+
+        try:
+            # Local copy of shops, customer types and other rarely changing data.
+            self.reference = reference.ReferenceCache(reference.default_path(self.c["account_id"], self.profile))
+        except:
+            self.debug_append_log("Unable to open reference data cache.", "window,debug")
+
+        try:
+            # Local store of completed sales used by exports.
+            self.warehouse = warehouse.SalesWarehouse(warehouse.default_path(self.c["account_id"], self.profile))
+        except:
+            self.debug_append_log("Unable to open local sales warehouse.", "window,debug")
+
+        # Images are loaded once the window is showing.
+        QTimer.singleShot(0, self.load_images)
 
         # Buttons
         self.ui.btn_SyncAllUsers.clicked.connect(self.create_update_customer_worker)
         self.ui.btn_DeleteVCUsers.clicked.connect(self.delete_customer_worker)
         self.ui.btn_ExportFolderPicker.clicked.connect(self.select_export_directory)
         self.ui.btn_ExportCharges.clicked.connect(self.export_charge_balance_worker)
-        self.ui.btn_GetCustomerTypes.clicked.connect(self.get_customer_types)
-        self.ui.btn_GetPaymentTypes.clicked.connect(self.get_payment_types)
+        self.ui.btn_GetCustomerTypes.clicked.connect(lambda: self.get_customer_types(force=True))
+        self.ui.btn_GetPaymentTypes.clicked.connect(lambda: self.get_payment_types(force=True))
         self.ui.btn_Authorize.clicked.connect(self.authorize_app)
         self.ui.btn_ChangeEncPassword.clicked.connect(self.change_password)
         self.ui.btn_OpenLog.clicked.connect(self.open_log_to_file)
@@ -199,8 +220,7 @@ class Main(QMainWindow):
 
         # UI Setup
         self.ui.txt_SettingsFileLocation.setText(str(config.config_file_location()))
-        self.ui.combo_CustomerType.clear()
-        self.ui.combo_CustomerType.addItems([''])
+        self.ui.list_CustomerType.clear()
         self.ui.combo_PaymentType.clear()
         self.ui.combo_PaymentType.addItems([''])
         self.ui.dateEdit_BeginExportRange.setDateTime(QDateTime.currentDateTime())
@@ -239,6 +259,11 @@ class Main(QMainWindow):
         if "debug_export" in self.c.keys():
             if self.c["debug_export"] is True:
                 self.ui.chk_DebugExport.setChecked(True)
+        if "vc_export_reconcile_totals" in self.c.keys():
+            if self.c["vc_export_reconcile_totals"] is True:
+                self.ui.chk_ExportOptionsReconcileTotals.setChecked(True)
+        if "vc_export_file_format" in self.c.keys():
+            self.ui.combo_ExportOptionsFileFormat.setCurrentText(self.c["vc_export_file_format"])
         if "import_options_creditamount" in self.c.keys():
             self.ui.spinBox_CreditAmount.setValue(self.c["import_options_creditamount"])
         if "import_options_lastsync" in self.c.keys():
@@ -252,8 +277,10 @@ class Main(QMainWindow):
         self.ls_payment_types = dict()
         self.ls_shops = dict()
         self.ls_employee = dict()
+        self.veracrossid_field = None
+        self.lastsync_field = None
 
-        # Get some initial LS Data
+        # Get some initial LS Data. Each list loads in the background and fills its combo when it arrives.
         self.get_customer_types()
         self.get_payment_types()
         self.get_CustomField()
@@ -267,22 +294,66 @@ class Main(QMainWindow):
         self.get_license()
 
         # Get Version Info
-        self.version = update.Update()
+        self.version = update.Update(session=sessions.pooled_session())
         try:
             self.ui.label_VersionInfo.setText(self.version.current_version)
         except:
             self.ui.label_VersionInfo.setText("Version Unknown")
 
-        # Check for Updates
-        try:
-            if self.version.update_avail():
-                self.debug_append_log("Updated Version Available!", "window,info")
-                self.debug_append_log("Latest Description:", "info,window")
-                self.debug_append_log(self.version.latest_description(), "window,info")
-                self.debug_append_log("Download at "
-                                      "https://github.com/beckf/lightspeed-vc-connector/releases/latest", "window,info")
-        except:
-            self.debug_append_log("Error checking for updates.", "window,debug")
+        # Report startup time once the window has painted.
+        self.startup_window = time.perf_counter()
+        QTimer.singleShot(0, self.startup_report)
+
+        # Check for Updates in the background
+        worker = Worker(self.check_for_updates)
+        worker.signals.result.connect(self.check_for_updates_complete)
+        worker.signals.error.connect(lambda error: self.debug_append_log("Error checking for updates.",
+                                                                         "window,debug"))
+        self.threadpool.start(worker)
+
+    def load_images(self):
+        """
+        Load the Qt image resources and show the icon.
+        :return:
+        """
+        import images
+
+        self.ui.lbl_Icon.setPixmap(QPixmap(":/images/icon.png"))
+
+    def startup_report(self):
+        """
+        Log how long startup took and which lazily imported modules are already loaded.
+        :return:
+        """
+        now = time.perf_counter()
+        self.debug_append_log("Startup: imports %.2fs, window %.2fs, first paint %.2fs." %
+                              (STARTUP_IMPORTED - STARTUP_BEGIN,
+                               self.startup_window - STARTUP_BEGIN,
+                               now - STARTUP_BEGIN), "info")
+        self.debug_append_log("Startup: loaded %s." % ", ".join([m for m in LAZY_MODULES if m in sys.modules]),
+                              "debug")
+
+    def check_for_updates(self):
+        """
+        Look for a newer release on GitHub. Runs in a worker.
+        :return: description of the newer release, or None when up to date
+        """
+        if self.version.update_avail():
+            return self.version.latest_description()
+        return None
+
+    def check_for_updates_complete(self, description):
+        """
+        Signal when check_for_updates is complete
+        :param description: description of the newer release, or None
+        :return:
+        """
+        if description is not None:
+            self.debug_append_log("Updated Version Available!", "window,info")
+            self.debug_append_log("Latest Description:", "info,window")
+            self.debug_append_log(description, "window,info")
+            self.debug_append_log("Download at "
+                                  "https://github.com/beckf/lightspeed-vc-connector/releases/latest", "window,info")
 
     def create_update_customer_worker(self):
         """
@@ -301,250 +372,20 @@ class Main(QMainWindow):
         self.debug_append_log("User Sync Complete.", "window,info")
 
     def create_update_customer(self):
-
-        param = {}
-        # Make sure we have a lastsync and veracross id field mapped.
-        if self.veracrossid_field is None or self.lastsync_field is None:
-            self.debug_append_log("Enter valid map fields for VeracrossID and LastSync first.", "window,info")
-            return None
-
-        # Determine if we are syncing VC changes after particular date and update params set to VC.
+        """
+        Sync customers with the options chosen in the window.
+        :return:
+        """
+        options = {
+            'user_type': self.ui.combo_SyncVCUserType.currentText(),
+            'grade_level': self.ui.combo_SyncGradeLevel.currentText(),
+            'force_sync': self.ui.checkBox_ForceSync.isChecked(),
+            'updated_after': None
+        }
         if self.ui.checkBox_SyncChangesAfterDate.isChecked():
-            updated_after_ui = self.ui.dateEdit_SyncUpdatedAfterDate.date()
-            param.update({"on_or_after_last_modified_date": str(updated_after_ui.toPyDate())})
-
-        # If we are working with students, add additional parameters.
-        if self.ui.combo_SyncVCUserType.currentText() == "Students":
-            self.debug_append_log("Getting Veracross Students (Current)", "window,info")
-
-            # Add a grade level filter
-            ## TODO: This no longer is a query parameter in VC API3... Will need to filter after pulling entire set.
-            if not self.ui.combo_SyncGradeLevel.currentText() == "None":
-                if "Other" in self.ui.combo_SyncGradeLevel.currentText():
-                    # Append non-standard grades to the grade_level param. 20-30
-                    param.update({"grade_level": ",".join(str(x) for x in list(range(20, 30)))})
-                else:
-                    param.update({"grade_level": self.ui.combo_SyncGradeLevel.currentText()})
-
-            # Limit to only current students
-            # deprecated in VCAPI3 param.update({"option": "2"})
-
-            # Show our parameters to debug log
-            self.debug_append_log("VC Parameters: " + str(param), "debug")
-
-            # Get Veracross data for students
-            if len(param) > 0:
-                vcdata = self.vc.pull("students", parameters=param)
-            else:
-                vcdata = self.vc.pull("students")
+            options['updated_after'] = self.ui.dateEdit_SyncUpdatedAfterDate.date().toPyDate()
 
-            # Get Lightspeed id number that matches customer_type Student
-            try:
-                ls_customerTypeID = self.ls_customer_types["Student"]
-            except:
-                self.debug_append_log("Unable to get CustomerType of Student from Lightspeed. "
-                                      "Check name of CustomerType in Lightspeed.", "window,info")
-
-        # Determine if we want FacultyStaff from VC
-        elif self.ui.combo_SyncVCUserType.currentText() == "Faculty Staff":
-            # Let user know whats up
-            self.debug_append_log("Getting Veracross Faculty Staff (Faculty and Staff)", "window,info")
-            # Limit to roles 1 & 2 in VC Api.
-
-            # deprecated in VC API3.
-            # param.update({"roles": "1,2"})
-
-            # Show parameters to debug log
-            self.debug_append_log("VC Parameters: " + str(param), "debug")
-
-            # Get Veracross data for Faculty Staff
-            vcdata = self.vc.pull("staff_faculty")
-
-            # Determine what Lightspeed customer id number for FacStaff
-            try:
-                ls_customerTypeID = self.ls_customer_types["FacultyStaff"]
-            except:
-                self.debug_append_log("Unable to get CustomerType of FacultyStaff from Lightspeed. "
-                                      "Check name of CustomerType in Lightspeed.", "window,info")
-
-        # User did not select a user type
-        else:
-            self.debug_append_log("Select Veracross User Type first.", "window,info")
-            return None
-
-        # Going to use progress bar.  Make sure it is at zero first.
-        # self.ui.progressBar.setValue(0)
-
-        # Determine each increment for progress bar.
-        # increment = 100 / len(vcdata)
-        # total_increment = 0
-
-        # Loop through the data from VC.
-        for i in vcdata:
-
-            # increment the progress bar.
-            # total_increment = total_increment + increment
-            # self.ui.progressBar.setValue(int(total_increment))
-
-            self.debug_append_log("Processing VC Record {}".format(i["id"]), "debug")
-
-            # Get household data for this person
-            h = self.vc.pull("households/" + str(i["household_id"]))
-
-            # Set search parameters for lightspeed and see if we find someone in LS.
-            lsparam = dict(load_relations='all', limit=1, companyRegistrationNumber=str(i["id"]))
-            check_current = self.ls.get("Customer", parameters=lsparam)
-
-            # Format data to how it should look. First name will format later.
-            vc_formatted = {'Customer':
-                                {'firstName': '',
-                                 'lastName': i["last_name"],
-                                 'companyRegistrationNumber': i["id"],
-                                 'customerTypeID': ls_customerTypeID,
-                                 'Contact': {
-                                     'custom': i["id"],
-                                     'noEmail': 'false',
-                                     'noPhone': 'false',
-                                     'noMail': 'false',
-                                     'Emails': {
-                                         'ContactEmail': {
-                                             'address': i["email_1"],
-                                             'useType': 'Primary'
-                                         }
-                                     },
-                                     'Addresses': {
-                                         'ContactAddress': {
-                                             'address1': h["address_line_1"],
-                                             'address2': h["address_line_2"],
-                                             'city': h["city"],
-                                             'state': h["state_or_province"],
-                                             'zip': h["zip"],
-                                             'country': '',
-                                             'countryCode': '',
-                                             'stateCode': ''
-                                         }
-                                     }
-                                 },
-                                 'CreditAccount': {
-                                     'creditLimit': str(self.c["import_options_creditamount"]) + '.00'
-                                 },
-                                 'CustomFieldValues': {
-                                     'CustomFieldValue': [{
-                                         'customFieldID': self.veracrossid_field,
-                                         'value': i["id"]
-                                     }, {
-                                         'customFieldID': self.lastsync_field,
-                                         'value': str(datetime.datetime.now())
-                                     }
-                                     ]}
-                                 }
-                            }
-
-            # Update data to use correct nick name format from VC.
-            # Added becuase of bug in VC API where sometimes one is returned over other.
-            if 'preferred_name' in i:
-                if i['preferred_name'] is None:
-                    vc_formatted['Customer']['firstName'] = i['first_name']
-                else:
-                    vc_formatted['Customer']['firstName'] = i['preferred_name']
-            elif 'first_name' in i:
-                vc_formatted['Customer']['firstName'] = i['first_name']
-
-            # Did we find a record in lightspeed to sync to?
-            if check_current:
-
-                # Create two dictionaries one for VC and the other for LS
-                # We will see if they match later.
-                vc_person = dict()
-                ls_customer = dict()
-
-                # Format VC Data for comparison
-                vc_person["personpk"] = str(i["id"])
-                vc_person["last_name"] = i["last_name"]
-                if 'preferred_name' in i:
-                    if i['preferred_name'] is None:
-                        vc_person["first_name"] = i['first_name']
-                    else:
-                        vc_person["first_name"] = i['preferred_name']
-                elif 'first_name' in i:
-                    vc_person["first_name"] = i['first_name']
-
-                # Handle missing email
-                if i["email_1"] is None:
-                    vc_person["email"] = ''
-                else:
-                    vc_person["email"] = i["email_1"]
-
-                vc_person["address_1"] = h["address_line_1"]
-                if h["address_line_2"] is None:
-                    vc_person["address_2"] = ''
-                else:
-                    vc_person["address_2"] = h["address_line_2"]
-                vc_person["city"] = h["city"]
-                vc_person["zip"] = h["zip"]
-                vc_person["state"] = h["state_or_province"]
-
-                # Format LS Data for comparison
-                try:
-                    ls_customer["personpk"] = str(check_current["Customer"]["Contact"]["custom"])
-                except:
-                    ls_customer["personpk"] = ""
-
-                ls_customer["last_name"] = check_current["Customer"]["lastName"]
-                ls_customer["first_name"] = check_current["Customer"]["firstName"]
-
-                # Handle missing email addresses.
-                try:
-                    ls_customer["email"] = check_current["Customer"]["Contact"]["Emails"]["ContactEmail"]["address"]
-                except:
-                    ls_customer["email"] = ''
-
-                # Handle missing mailing addresses
-                try:
-                    ls_customer["address_1"] = check_current["Customer"]["Contact"]["Addresses"]["ContactAddress"][
-                        "address1"]
-                    ls_customer["address_2"] = check_current["Customer"]["Contact"]["Addresses"]["ContactAddress"][
-                        "address2"]
-                    ls_customer["city"] = check_current["Customer"]["Contact"]["Addresses"]["ContactAddress"]["city"]
-                    ls_customer["zip"] = check_current["Customer"]["Contact"]["Addresses"]["ContactAddress"]["zip"]
-                    ls_customer["state"] = check_current["Customer"]["Contact"]["Addresses"]["ContactAddress"]["state"]
-                except:
-                    ls_customer["address_1"] = ''
-                    ls_customer["address_2"] = ''
-                    ls_customer["city"] = ''
-                    ls_customer["zip"] = ''
-                    ls_customer["state"] = ''
-
-                # Compare the data. Are the two dictionaries the same...
-                if not ls_customer == vc_person or self.ui.checkBox_ForceSync.isChecked():
-                    self.debug_append_log("Updating customer {} {}.".format(vc_formatted['Customer']['firstName'],
-                                                                            vc_formatted['Customer']['lastName']),
-                                          "info")
-                    vc_formatted['Customer']['customerID'] = check_current['Customer']['customerID']
-                    self.ls.update("Customer/" + vc_formatted['Customer']['customerID'], vc_formatted["Customer"])
-                else:
-                    self.debug_append_log(
-                        "Record {} {} already up to date.".format(vc_formatted['Customer']['firstName'],
-                                                                  vc_formatted['Customer']['lastName']),
-                        "info")
-            else:
-                # Add new user when not found in LS
-                self.debug_append_log("Adding new Lightspeed Customer for {} {}".format(
-                    vc_formatted['Customer']['firstName'],
-                    vc_formatted['Customer']['lastName']),
-                    "info")
-                try:
-                    new_customer = self.ls.create("Customer", vc_formatted["Customer"])
-                    self.debug_append_log(
-                        "New Customer # {} Added: {} {}".format(new_customer['Customer']['customerID'],
-                                                                new_customer['Customer']['firstName'],
-                                                                new_customer['Customer']['lastName']),
-                        "info")
-                except:
-                    self.debug_append_log("Unable to add new Lightspeed Customer for {} {}".format(
-                        vc_formatted['Customer']['firstName'],
-                        vc_formatted['Customer']['lastName']),
-                        "info")
+        return self.job().sync_customers(options)
 
     def delete_customer_worker(self):
         """
@@ -575,9 +416,8 @@ class Main(QMainWindow):
         for i in self.vc.pull("students"):
             valid_vc_ids.append(i["id"])
 
-        current_customers = self.ls.get("Customer", dict(load_relations="all"))
-
-        for i in current_customers["Customer"]:
+        # Read every customer before deleting so paging is not shifted by the deletes.
+        for i in lsapi.get_records(self.ls, "Customer", parameters=dict(load_relations="all")):
             if i["companyRegistrationNumber"] != '':
                 if int(i["companyRegistrationNumber"]) not in valid_vc_ids:
                     if float(i["CreditAccount"]["balance"]) <= 0:
@@ -613,409 +453,115 @@ class Main(QMainWindow):
 
     def export_charge_balance(self):
         """
-        Export Charges from LS in CSV
+        Export Charges from LS with the options chosen in the window.
         :return:
         """
-        # Warn about debugging
-        if self.ui.chk_DebugExport.isChecked():
-            self.debug_append_log("Export debugging enabled.", "window,info")
-
-        # Set current Timezone
-        current_store = self.ui.combo_ExportShopSelect.currentText()
-        shop_timezone_name = self.ls_shops[current_store]["timeZone"]
-        timezone = pytz.timezone(shop_timezone_name)
-        shop_timezone_utc_offset = datetime.datetime.now(timezone).strftime('%z')
-        shop_timezone_utc_offset_iso = shop_timezone_utc_offset[:3] + ":" + shop_timezone_utc_offset[3:]
-        self.debug_append_log(
-            "Found %s timezone for shop named %s." % (shop_timezone_name, self.ls_shops[current_store]["name"]),
-            "window,info")
-
-        # Customer Type
-        ct = str(self.ui.combo_CustomerType.currentText())
-        ct_id = self.ls_customer_types[ct]
-        self.debug_append_log("Filtering results to customerType %s, id %s" % (ct, ct_id), "debug")
-
-        # Get selected shop
-        shop = str(self.ui.combo_ExportShopSelect.currentText())
-        shop_id = self.ls_shops[shop]['shopID']
-        self.debug_append_log("Filtering results to shop %s, id %s" % (shop, shop_id), "debug")
-
-        if self.ui.chk_ClearCharges.isChecked():
-            pt = str(self.ui.combo_PaymentType.currentText())
-            pt_id = self.ls_payment_types[pt]
-
         # Ensure there is an export location
         if len(self.ui.line_ExportFolder.text()) == 0:
             self.debug_append_log("Missing export folder location.", "window,info")
             self.select_export_directory()
 
-        # Notify UI
-        self.debug_append_log("Export started for customer type: " + str(ct), "window,info")
-
-        # !! Sale Line Export !!
-
-        # Export SaleLine Data
-        begin_date_ui = self.ui.dateEdit_BeginExportRange.date()
-        begin_date = begin_date_ui.toPyDate()
-        end_date_ui = self.ui.dateEdit_EndExportRange.date()
-        end_date = end_date_ui.toPyDate()
-
-        if len(str(begin_date)) != 10 or len(str(end_date)) != 10:
-            self.debug_append_log("Invalid begin or end date.", "info")
-            self.debug_append_log(str(begin_date), "info")
-            return None
-
-        try:
-            parameters = {}
-            parameters['load_relations'] = 'all'
-            parameters['completed'] = 'true'
-            parameters['timeStamp'] = '{},{}T00:00:00-04:00,{}T23:59:59{}'.format("><",
-                                                                                  begin_date,
-                                                                                  end_date,
-                                                                                  shop_timezone_utc_offset_iso)
-            self.debug_append_log("Querying Lightspeed \"Sales\" data point with parameters " + str(parameters),
-                                  "debug")
-            salelines = self.ls.get("Sale", parameters=parameters)
-        except:
-            salelines = None
-            self.debug_append_log("Unable to get SaleLine data.", "info")
-
-        saleline_export_data = []
-
-        # throw down some headers.
-        f = ['person_id',
-             'customer_account_number',
-             'customer_name',
-             'transaction_source',
-             'transaction_type',
-             'school_year',
-             'item_date',
-             'catalog_item_fk',
-             'description',
-             'quantity',
-             'unit_price',
-             'purchase_amount',
-             'tax_amount',
-             'total_amount',
-             'pos_transaction_id'
-             ]
-
-        # Add debug fields if requested
-        if self.ui.chk_DebugExport.isChecked():
-            f.append('debug_timestamp')
-            f.append('debug_shopID')
-
-        saleline_export_data.append(f)
-
-        # Determine each increment for progress bar.
-        increment = 100 / len(salelines['Sale'])
-        total_increment = 0
-
-        for i in salelines['Sale']:
-
-            # increment the progress bar.
-            #total_increment = total_increment + increment
-            #self.ui.progressBar.setValue(int(total_increment))
-
-            # Does this invoice have a payment that is on account.
-            on_account = False
-
-            if 'SalePayments' in i:
-                if isinstance(i['SalePayments']['SalePayment'], list):
-                    for p in i['SalePayments']['SalePayment']:
-                        if p['PaymentType']['code'] == 'SCA':
-                            on_account = True
-                else:
-                    if i['SalePayments']['SalePayment']['PaymentType']['code'] == 'SCA':
-                        on_account = True
-
-            if 'SaleLines' in i and on_account is True:
-
-                # Check this is a customer we requested.
-                if i['Customer']['customerTypeID'] != ct_id:
-                    continue
-
-                # Verify there are not mixed payments with on credit account
-                if isinstance(i['SalePayments']['SalePayment'], list):
-                    for p in i['SalePayments']['SalePayment']:
-                        if p['PaymentType']['code'] == 'SCA':
-                            # Skip sales that mix payments with on_account
-                            self.debug_append_log("Skipping Sale #%s (%s %s): Other payments mixed with On Account." %
-                                                  (str(i['saleID']),
-                                                   str(i['Customer']['firstName']),
-                                                   str(i['Customer']['lastName'])),
-                                                  "info")
-                            continue
-
-                # Depending on how many items sold,
-                # types of salelines are returned.
-                # List of dictionaries and a single dictionary.
-                # Is this multiline sale?
-                if isinstance(i['SaleLines']['SaleLine'], list):
-
-                    for s in i['SaleLines']['SaleLine']:
-
-                        # Ignore this entry if it was not in the shop selected.
-                        try:
-                            if s['shopID'] != shop_id:
-                                self.debug_append_log("ShopID for entry is not the shop that was requested, "
-                                                      "skipping entry: %s" % str(s), "debug")
-                                continue
-                        except:
-                            self.debug_append_log("Unable to determine shopID for entry: %s." % s, "debug")
-                            continue
-
-                        # Determine correct item description to use:
-                        try:
-                            if 'Item' in s:
-                                if 'description' in s['Item']:
-                                    description = str(s['Item']['description'])
-                                else:
-                                    description = "Unknown"
-                            elif 'Note' in s:
-                                if 'note' in s['Note']:
-                                    description = str(s['Note']['note'])
-                                    self.debug_append_log("Debug Output: Sale line without actual item: " +
-                                                          str(description), "debug")
-                            else:
-                                description = "Unknown"
-                        except:
-                            description = "Unknown"
-
-                        # Format the entry to be added to our export file.
-                        try:
-
-                            saleline_single = [str(i['Customer']['companyRegistrationNumber']),
-                                               str(i['Customer']['companyRegistrationNumber']),
-                                               str(i['Customer']['firstName'] + " " + i['Customer']['lastName']),
-                                               self.ui.txt_ExportOptionsTransactionSource.text(),
-                                               self.ui.txt_ExportOptionsTransactionType.text(),
-                                               self.ui.txt_ExportOptionsSchoolYear.text(),
-                                               str(i['timeStamp'][:10]),
-                                               self.ui.txt_ExportOptionsCatalog_Item_fk.text(),
-                                               str(description),
-                                               str(s['unitQuantity']),
-                                               Decimal(s['unitPrice']) -
-                                               (Decimal(s['calcLineDiscount']) / int(s['unitQuantity'])),
-                                               Decimal(s['displayableSubtotal']),
-                                               self.roundup_decimal(Decimal(s['calcTax1'])),
-                                               self.roundup_decimal(Decimal(s['calcTotal'])),
-                                               str(i['saleID'])
-                                               ]
-
-                            # Debug fields
-                            if self.ui.chk_DebugExport.isChecked():
-                                saleline_single.append(str(i['timeStamp']))
-                                saleline_single.append(str(i['shopID']))
-
-                            saleline_export_data.append(saleline_single)
-                        except:
-                            self.debug_append_log("Unable to append item (multisale) %s for Sale %s data to CSV." %
-                                                  (str(s['saleLineID']), str(i['saleID'])), "info")
-                            self.debug_append_log("Debug Output: " + str(s), "debug")
-                else:
-                    try:
-                        # Is this a singleline sale?
-                        if 'Item' in i["SaleLines"]["SaleLine"]:
-                            # Need to be able to identify the item by it's type and not if it has items.
-                            # What if only single misc charge?  To do this the way we clear balances needs to be change.
-                            # Ideally we would want a Payment to CC Account.
-                            # if isinstance(i["SaleLines"]["SaleLine"], dict):
-                            # Ignore this entry if it was not in the shop selected.
-                            if i["SaleLines"]["SaleLine"]["shopID"] != shop_id:
-                                self.debug_append_log("ShopID for entry is not the shop that was requested, "
-                                                      "skipping entry: %s" % str(i["SaleLines"]["SaleLine"]),
-                                                      "debug")
-                                continue
-
-                            # Determine a description
-                            try:
-                                if 'Item' in i["SaleLines"]["SaleLine"]:
-                                    if 'description' in i["SaleLines"]["SaleLine"]['Item']:
-                                        description = str(i["SaleLines"]["SaleLine"]['Item']['description'])
-                                    else:
-                                        description = "Unknown"
-                                elif 'Note' in i["SaleLines"]["SaleLine"]:
-                                    if 'note' in i["SaleLines"]["SaleLine"]['Note']:
-                                        description = str(i["SaleLines"]["SaleLine"]['Note']['note'])
-                                        self.debug_append_log("Debug Output: Sale line without actual item: " +
-                                                              str(description), "debug")
-                                else:
-                                    description = "Unknown"
-                            except:
-                                description = "Unknown"
-
-                            # Format the entry to be added to our export file.
-                            saleline_single = [str(i['Customer']['companyRegistrationNumber']),
-                                               str(i['Customer']['companyRegistrationNumber']),
-                                               str(i['Customer']['firstName'] + " " + i['Customer']['lastName']),
-                                               self.ui.txt_ExportOptionsTransactionSource.text(),
-                                               self.ui.txt_ExportOptionsTransactionType.text(),
-                                               self.ui.txt_ExportOptionsSchoolYear.text(),
-                                               str(i["SaleLines"]["SaleLine"]['timeStamp'][:10]),
-                                               self.ui.txt_ExportOptionsCatalog_Item_fk.text(),
-                                               str(description),
-                                               str(i["SaleLines"]["SaleLine"]['unitQuantity']),
-                                               Decimal(i["SaleLines"]["SaleLine"]['unitPrice']) -
-                                               (Decimal(i["SaleLines"]["SaleLine"]['calcLineDiscount']) /
-                                                int(i["SaleLines"]["SaleLine"]['unitQuantity'])),
-                                               Decimal(i["SaleLines"]["SaleLine"]['displayableSubtotal']),
-                                               self.roundup_decimal(
-                                                   Decimal(i["SaleLines"]["SaleLine"]['calcTax1'])),
-                                               self.roundup_decimal(
-                                                   Decimal(i["SaleLines"]["SaleLine"]['calcTotal'])),
-                                               str(i['saleID'])
-                                               ]
-                            # Debug fields
-                            if self.ui.chk_DebugExport.isChecked():
-                                saleline_single.append(str(i["SaleLines"]["SaleLine"]['timeStamp']))
-                                saleline_single.append(str(i["SaleLines"]["SaleLine"]['shopID']))
-
-                            saleline_export_data.append(saleline_single)
-                    except:
-                        self.debug_append_log("Unable to append (single) saleline for sale # " + str(i['saleID']),
-                                              "info")
-                        self.debug_append_log("Debug Output: " + str(i["SaleLines"]["SaleLine"]), "debug")
-
-        try:
-            filename = str(self.ui.line_ExportFolder.text())
-            filename = filename + f'/{shop}_Lightspeed_Salelines_Export_' + \
-                       datetime.datetime.now().strftime('%m%d%Y-%H%m%S') + '.csv'
-            self.debug_append_log(str(filename), "info")
-        except:
-            self.debug_append_log("Unable to determine export file.", "window,info")
-
-        try:
-            #writer = pandas.ExcelWriter(filename, engine='xlsxwriter')
-            panda_data = pandas.DataFrame(saleline_export_data)
-            #panda_data.to_excel(writer, sheet_name='Sheet1', header=False, index=False)
-            #writer.close()
-            panda_data.to_csv(filename, index=False)
-        except Exception as error:
-            self.debug_append_log("Failed to format SaleLine data.", "window,info")
-            self.debug_append_log(error, "debug")
-            return None
-
-        # !! Account Balance Export !!
-        try:
-            # Get Customers with Balance on account. Used to export balances and clear accounts.
-            customers = self.ls.get("Customer", parameters=dict(load_relations='["CreditAccount"]'))
-        except:
-            self.debug_append_log("Unable to get Customer data from Lightspeed.", "window,info")
-            return None
-
-        try:
-            export_data = []
-
-            f = ['first_name',
-                 'last_name',
-                 'veracross_id',
-                 'lightspeed_cust_type',
-                 'balance',
-                 'lightspeed_cust_num']
-
-            export_data.append(f)
-
-            for i in customers['Customer']:
-                if 'CreditAccount' in i:
-                    if (float(i['CreditAccount']['balance']) > 0) and (int(i['customerTypeID']) == int(ct_id)):
-                        a = [i['firstName'],
-                             i['lastName'],
-                             i['companyRegistrationNumber'],
-                             i['customerTypeID'],
-                             i['CreditAccount']['balance'],
-                             i['customerID']]
-                        export_data.append(a)
-
-                        if self.ui.chk_ClearCharges.isChecked():
-                            selected_emp = self.ui.combo_ClearChargesEmployee.currentText()
-                            emp_id = selected_emp.split("ID:", 1)[1]
-                            # Clear the balance for this account
-                            self.clear_account_balances(int(i['customerID']),
-                                                        float(i['CreditAccount']['balance']),
-                                                        int(pt_id),
-                                                        int(i["creditAccountID"]),
-                                                        int(emp_id))
+        options = {
+            'shop': self.ui.combo_ExportShopSelect.currentText(),
+            'customer_types': [i.text() for i in self.ui.list_CustomerType.selectedItems()],
+            'begin_date': self.ui.dateEdit_BeginExportRange.date().toPyDate(),
+            'end_date': self.ui.dateEdit_EndExportRange.date().toPyDate(),
+            'export_folder': self.ui.line_ExportFolder.text(),
+            'debug': self.ui.chk_DebugExport.isChecked(),
+            'reconcile': self.ui.chk_ExportOptionsReconcileTotals.isChecked(),
+            'file_format': self.ui.combo_ExportOptionsFileFormat.currentText(),
+            'clear_charges': self.ui.chk_ClearCharges.isChecked(),
+            'payment_type': self.ui.combo_PaymentType.currentText(),
+            'employee': self.ui.combo_ClearChargesEmployee.currentText(),
+            'transaction_source': self.ui.txt_ExportOptionsTransactionSource.text(),
+            'transaction_type': self.ui.txt_ExportOptionsTransactionType.text(),
+            'school_year': self.ui.txt_ExportOptionsSchoolYear.text(),
+            'catalog_item_fk': self.ui.txt_ExportOptionsCatalog_Item_fk.text()
+        }
 
-        except:
-            self.debug_append_log("Failed to format CreditBalance Export data.", "info")
-            return None
+        return self.job().export_charges(options)
 
+    def job(self):
+        """
+        Job for the settings and reference data loaded in the window.
+        :return: jobs.Job
+        """
+        job = jobs.Job(self.c, self.ls, self.vc, self.debug_append_log,
+                       reference_cache=self.reference,
+                       sales_warehouse=self.warehouse,
+                       clearing_engine=self.clearing)
+        job.ls_customer_types = self.ls_customer_types
+        job.ls_payment_types = self.ls_payment_types
+        job.ls_shops = self.ls_shops
+        job.ls_employee = self.ls_employee
+        job.veracrossid_field = self.veracrossid_field
+        job.lastsync_field = self.lastsync_field
+        return job
+
+    def reference_records(self, source, loaded, force=False):
+        """
+        Pass Lightspeed reference data to loaded. Cached data is passed straight away. Data that is
+        missing or older than the cache TTL is fetched in a worker and passed to loaded when it arrives,
+        so the window never waits on Lightspeed.
+        :param source: Lightspeed source such as Shop
+        :param loaded: method that fills the app from a list of records, or None when unavailable
+        :param force: revalidate even when the cache is fresh
+        :return:
+        """
         try:
-            filename = str(self.ui.line_ExportFolder.text())
-            filename = filename + f'/{shop}_Lightspeed_Balance_Export_' + \
-                       datetime.datetime.now().strftime('%m%d%Y-%H%m%S') + '.csv'
-
-            # writer = pandas.ExcelWriter(filename, engine='xlsxwriter')
-            panda_data = pandas.DataFrame(export_data)
-            # panda_data.to_excel(writer, sheet_name='Sheet1', header=False, index=False)
-            # writer.close()
-            panda_data.to_csv(filename, index=False)
+            records = self.reference.get(source)
+            if records is not None:
+                loaded(records)
+                if not force and self.reference.is_fresh(source):
+                    return
+
+            worker = Worker(self.reference.refresh, self.ls, source)
+            worker.signals.result.connect(loaded)
+            worker.signals.error.connect(lambda error: self.reference_records_error(source, records, loaded, error))
+            self.threadpool.start(worker)
         except Exception as error:
-            self.debug_append_log("Failed to export balance data.", "window,info")
-            self.debug_append_log(error, "debug")
-            return None
+            self.reference_records_error(source, None, loaded, (type(error), error, ""))
 
-        # Finish of progress bar
-        # self.ui.progressBar.setValue(int(100))
-
-    def clear_account_balances(self, customerID, balance, paymentID, creditAccountID, emp_id):
-        try:
-            formatted_request = {
-                "employeeID": emp_id,
-                "registerID": 1,
-                "shopID": 1,
-                "customerID": customerID,
-                "completed": 'true',
-                "SaleLines": {
-                    "SaleLine": {
-                        "itemID": 0,
-                        "note": "Balance Cleared by LSVCConnector",
-                        "unitQuantity": 1,
-                        "unitPrice": -float(balance),
-                        "taxClassID": 0,
-                        "avgCost": 0,
-                        "fifoCost": 0
-                    }
-                },
-                "SalePayments": {
-                    "SalePayment": {
-                        "amount": -float(balance),
-                        "paymentTypeID": paymentID,
-                        "creditAccountID": creditAccountID
-                    }
-                }
-            }
-        except:
-            self.debug_append_log("Unable to format data to clear balances.", "window,info")
+    def reference_records_error(self, source, records, loaded, error):
+        """
+        Signal when reference data could not be fetched. Cached data stays in use.
+        :param source: Lightspeed source such as Shop
+        :param records: cached records already passed to loaded, or None
+        :param loaded: method that fills the app from a list of records
+        :param error: exception type, value and traceback
+        :return:
+        """
+        self.debug_append_log("Unable to get %s data from Lightspeed." % source, "debug")
+        self.debug_append_log(str(error[1]), "debug")
+        if records is None:
+            loaded(None)
 
-        try:
-            self.ls.create('Sale', data=formatted_request)
-            self.debug_append_log("Cleared balance of {} of customerID {}".format(str(balance), str(customerID)),
-                                  "info")
-        except:
-            self.debug_append_log("Unable to clear balance for customerID {}".format(str(customerID)), "info")
-            self.debug_append_log(formatted_request, "debug")
+    def get_customer_types(self, force=False):
+        self.reference_records("CustomerType", self.set_customer_types, force)
 
-    def get_customer_types(self):
+    def set_customer_types(self, records):
+        self.ls_customer_types = dict()
         try:
-            ct = self.ls.get("CustomerType")
-            for i in ct['CustomerType']:
-                self.ls_customer_types[i["name"]] = i["customerTypeID"]
+            self.ls_customer_types = jobs.customer_type_ids(records)
         except:
             self.debug_append_log("Cannot get customer types from API, or none exist.", "window,info")
         # Update UI
         try:
-            self.ui.combo_CustomerType.clear()
-            self.ui.combo_CustomerType.addItems(self.ls_customer_types.keys())
+            self.ui.list_CustomerType.clear()
+            self.ui.list_CustomerType.addItems(self.ls_customer_types.keys())
+            # Select the first type, further types are added to the export explicitly.
+            if self.ui.list_CustomerType.count():
+                self.ui.list_CustomerType.item(0).setSelected(True)
         except:
             self.debug_append_log("Error getting customer types.", "window,info")
 
-    def get_payment_types(self):
+    def get_payment_types(self, force=False):
+        self.reference_records("PaymentType", self.set_payment_types, force)
+
+    def set_payment_types(self, records):
+        self.ls_payment_types = dict()
         try:
-            pt = self.ls.get("PaymentType")
-            for i in pt['PaymentType']:
-                self.ls_payment_types[i["name"]] = i["paymentTypeID"]
+            self.ls_payment_types = jobs.payment_type_ids(records)
         except:
             self.debug_append_log("Cannot get payment types from API.", "window,info")
 
@@ -1031,25 +577,26 @@ class Main(QMainWindow):
         except:
             self.debug_append_log("Unable to set default payment type to Credit Account.", "window,info")
 
-    def get_CustomField(self):
+    def get_CustomField(self, force=False):
         """
         Get the Lightspeed id for the customfields
         :return:
         """
+        self.reference_records("Customer/CustomField", self.set_CustomField, force)
+
+    def set_CustomField(self, records):
+        """
+        Match the import field names to Lightspeed custom fields
+        :param records: CustomField records
+        :return:
+        """
         self.veracrossid_field = None
         self.lastsync_field = None
 
         try:
-            custom_fields = self.ls.get("Customer/CustomField")
-            if isinstance(custom_fields["CustomField"], list):
-                for cf in custom_fields["CustomField"]:
-                    # Find internal id for VeracrossID Field
-                    if str(cf["name"]) == str(self.ui.line_VeracrossIDField.text()):
-                        self.veracrossid_field = cf["customFieldID"]
-
-                    # Find internal id for LastSync Field
-                    if str(cf["name"]) == str(self.ui.line_LastSyncField.text()):
-                        self.lastsync_field = cf["customFieldID"]
+            # Find internal ids for the VeracrossID and LastSync Fields
+            self.veracrossid_field = jobs.custom_field_id(records, self.ui.line_VeracrossIDField.text())
+            self.lastsync_field = jobs.custom_field_id(records, self.ui.line_LastSyncField.text())
 
         except:
             self.debug_append_log("Something went wrong when trying to match custom import fields!", "debug")
@@ -1059,14 +606,13 @@ class Main(QMainWindow):
         if self.lastsync_field is None:
             self.debug_append_log("Unable to find Lightspeed custom import field for LastSync.", "window,info")
 
-    def get_shops(self):
+    def get_shops(self, force=False):
+        self.reference_records("Shop", self.set_shops, force)
+
+    def set_shops(self, records):
+        self.ls_shops = dict()
         try:
-            shop = self.ls.get("Shop")
-            if isinstance(shop['Shop'], list):
-                for s in shop['Shop']:
-                    self.ls_shops[s["name"]] = s
-            else:
-                self.ls_shops[shop["Shop"]["name"]] = shop['Shop']
+            self.ls_shops = jobs.shops_by_name(records)
         except:
             self.debug_append_log("Error getting shop names.", "info")
 
@@ -1074,20 +620,19 @@ class Main(QMainWindow):
         try:
             self.ui.combo_ExportShopSelect.clear()
             self.ui.combo_ExportShopSelect.addItems(self.ls_shops.keys())
+            if len(self.ls_shops) > 1:
+                self.ui.combo_ExportShopSelect.addItem(jobs.ALL_SHOPS)
         except:
             self.debug_append_log("Error adding shops to UI.", "window,info")
             self.debug_append_log(str(self.ls_shops), "debug")
 
-    def get_employees(self):
+    def get_employees(self, force=False):
+        self.reference_records("Employee", self.set_employees, force)
+
+    def set_employees(self, records):
+        self.ls_employee = dict()
         try:
-            emp = self.ls.get("Employee")
-            if isinstance(emp['Employee'], list):
-                for s in emp['Employee']:
-                    name = s["firstName"] + " " + s["lastName"] + " ID:" + s["employeeID"]
-                    self.ls_employee[name] = s
-            else:
-                name = emp["Shop"]["firstName"] + " " + emp["Shop"]["lastName"] + " ID:" + emp["Shop"]["employeeID"]
-                self.ls_employee[name] = emp['Employee']
+            self.ls_employee = jobs.employees_by_name(records)
         except:
             self.debug_append_log("Error getting employees from LS.", "window,info")
 
@@ -1108,7 +653,10 @@ class Main(QMainWindow):
             if len(self.c["client_id"]) > 0:
                 self.auth_url = "https://cloud.lightspeedapp.com/oauth/authorize.php?" \
                                 "response_type=code&client_id={}&scope=employee:all".format(self.c["client_id"])
-                self.authorize_window = AuthorizeLS(self.auth_url)
+                # QtWebEngine is slow to load and only needed here.
+                import authorize
+
+                self.authorize_window = authorize.AuthorizeLS(self.auth_url)
                 self.authorize_window.interceptor.code_returned.connect(self.authorization_complete)
         except:
             QMessageBox.question(self, 'Authorization Failed',
@@ -1133,13 +681,13 @@ class Main(QMainWindow):
 
     def debug_append_log(self, text, level):
         """
-        Write to log window
+        Write to log window. Safe to call from workers, the window is updated by the log sink.
         :param text:
         :return:
         """
         try:
             if "window" in level:
-                self.ui.txtb_SyncLog.append(text)
+                self.log_sink.put(text, level)
         except:
             traceback.print_exc()
 
@@ -1155,13 +703,41 @@ class Main(QMainWindow):
         except:
             traceback.print_exc()
 
-    def roundup_decimal(self, x):
+    def show_log_records(self, records):
+        """
+        Append a batch of log records to the log window in one update.
+        :param records: list of text and level
+        :return:
+        """
+        # Follow new records unless the user scrolled up to read.
+        scrollbar = self.ui.list_SyncLog.verticalScrollBar()
+        follow = scrollbar.value() == scrollbar.maximum()
+        self.log_model.append_records(records)
+        if follow:
+            self.ui.list_SyncLog.scrollToBottom()
+
+    def filter_log(self):
+        """
+        Show the log records matching the level and search text chosen above the log window.
+        :return:
+        """
+        self.log_filter.set_filter(self.ui.combo_LogLevel.currentText(), self.ui.line_LogSearch.text())
+        if self.log_filter.active():
+            self.log_filter.setSourceModel(self.log_model)
+            self.ui.list_SyncLog.setModel(self.log_filter)
+        else:
+            # Without a filter the view reads the model directly, so appends stay constant time.
+            self.ui.list_SyncLog.setModel(self.log_model)
+            self.log_filter.setSourceModel(None)
+        self.ui.list_SyncLog.scrollToBottom()
+
+    def copy_log_selection(self):
         """
-        Self-Explanatory
-        :param x: rounded up decimal to two places.
+        Copy the selected log records to the clipboard.
         :return:
         """
-        return x.quantize(Decimal(".01"), rounding=ROUND_HALF_UP)
+        rows = sorted(self.ui.list_SyncLog.selectionModel().selectedIndexes(), key=lambda i: i.row())
+        QApplication.clipboard().setText("\n".join(i.data() for i in rows))
 
     def select_export_directory(self):
         self.export_dir = QFileDialog.getExistingDirectory(self, 'Select Directory for Export')
@@ -1194,6 +770,8 @@ class Main(QMainWindow):
             "vc_export_school_year": self.ui.txt_ExportOptionsSchoolYear.text(),
             "vc_export_transaction_type": self.ui.txt_ExportOptionsTransactionType.text(),
             "vc_export_transaction_source": self.ui.txt_ExportOptionsTransactionSource.text(),
+            "vc_export_reconcile_totals": self.ui.chk_ExportOptionsReconcileTotals.isChecked(),
+            "vc_export_file_format": self.ui.combo_ExportOptionsFileFormat.currentText(),
             "import_options_creditamount": self.ui.spinBox_CreditAmount.value(),
             "import_options_lastsync": self.ui.line_LastSyncField.text(),
             "import_options_veracrossid": self.ui.line_VeracrossIDField.text()
@@ -1205,9 +783,9 @@ class Main(QMainWindow):
             settings.update({"debug_export": False})
 
         # Save settings
-        config.save_settings(settings, "config", self.config_passwd)
+        config.save_profile(settings, self.profile, self.config_passwd)
         # Reload Settings
-        self.c = config.load_settings("config", self.config_passwd)
+        self.c = config.load_profile(self.profile, self.config_passwd)
         self.get_CustomField()
 
         # Suggest user restart the app
@@ -1220,6 +798,9 @@ class Main(QMainWindow):
             new_password = self.ui.txt_ChangeUpdatePassword.text()
             config.change_password(self.config_passwd, new_password)
             self.config_passwd = new_password
+            if self.token_cache is not None:
+                self.token_cache.password = new_password
+                self.token_cache.save()
             QMessageBox.question(self, 'Password Updated.',
                                  'The password has now been changed to: {}'.format(new_password),
                                  QMessageBox.Ok)
@@ -1257,14 +838,25 @@ class Main(QMainWindow):
         if os.path.isfile(import_file[0]):
             with open(import_file[0], "r") as infile:
                 import_json = json.load(infile)
-                config.save_settings(import_json, "config", self.config_passwd)
+                config.save_profile(import_json, self.profile, self.config_passwd)
                 # Reload Settings
-                self.c = config.load_settings("config", self.config_passwd)
+                self.c = config.load_profile(self.profile, self.config_passwd)
                 self.close()
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = Main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="settings location, overrides the %s environment variable" %
+                                         config.CONFIG_ENV)
+    parser.add_argument("--profile", default=config.DEFAULT_PROFILE,
+                        help="settings profile to open, see runner.py --list-profiles")
+    args, qt_args = parser.parse_known_args()
+    if not config.PROFILE_NAME.fullmatch(args.profile):
+        parser.error("profile names may only use letters, digits, _ and -")
+    if args.config:
+        config.set_config_file(args.config)
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = Main(args.profile)
     window.show()
     sys.exit(app.exec_())
@@ -210,9 +210,11 @@ class Ui_MainWindow(object):
         self.dateEdit_BeginExportRange = QtWidgets.QDateEdit(self.gridLayoutWidget_4)
         self.dateEdit_BeginExportRange.setObjectName("dateEdit_BeginExportRange")
         self.gridLayout_4.addWidget(self.dateEdit_BeginExportRange, 2, 1, 1, 1)
-        self.combo_CustomerType = QtWidgets.QComboBox(self.gridLayoutWidget_4)
-        self.combo_CustomerType.setObjectName("combo_CustomerType")
-        self.gridLayout_4.addWidget(self.combo_CustomerType, 1, 1, 1, 1)
+        self.list_CustomerType = QtWidgets.QListWidget(self.gridLayoutWidget_4)
+        self.list_CustomerType.setMaximumSize(QtCore.QSize(16777215, 50))
+        self.list_CustomerType.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
+        self.list_CustomerType.setObjectName("list_CustomerType")
+        self.gridLayout_4.addWidget(self.list_CustomerType, 1, 1, 1, 1)
         self.btn_ExportFolderPicker = QtWidgets.QPushButton(self.gridLayoutWidget_4)
         self.btn_ExportFolderPicker.setObjectName("btn_ExportFolderPicker")
         self.gridLayout_4.addWidget(self.btn_ExportFolderPicker, 4, 0, 1, 1)
@@ -317,7 +319,7 @@ class Ui_MainWindow(object):
         self.tab_ExportOptions = QtWidgets.QWidget()
         self.tab_ExportOptions.setObjectName("tab_ExportOptions")
         self.gridLayoutWidget_5 = QtWidgets.QWidget(self.tab_ExportOptions)
-        self.gridLayoutWidget_5.setGeometry(QtCore.QRect(10, 70, 611, 171))
+        self.gridLayoutWidget_5.setGeometry(QtCore.QRect(10, 70, 611, 231))
         self.gridLayoutWidget_5.setObjectName("gridLayoutWidget_5")
         self.gridLayout_5 = QtWidgets.QGridLayout(self.gridLayoutWidget_5)
         self.gridLayout_5.setContentsMargins(11, 11, 11, 11)
@@ -347,6 +349,22 @@ class Ui_MainWindow(object):
         self.label_21 = QtWidgets.QLabel(self.gridLayoutWidget_5)
         self.label_21.setObjectName("label_21")
         self.gridLayout_5.addWidget(self.label_21, 0, 0, 1, 1)
+        self.label_37 = QtWidgets.QLabel(self.gridLayoutWidget_5)
+        self.label_37.setObjectName("label_37")
+        self.gridLayout_5.addWidget(self.label_37, 4, 0, 1, 1)
+        self.chk_ExportOptionsReconcileTotals = QtWidgets.QCheckBox(self.gridLayoutWidget_5)
+        self.chk_ExportOptionsReconcileTotals.setText("")
+        self.chk_ExportOptionsReconcileTotals.setObjectName("chk_ExportOptionsReconcileTotals")
+        self.gridLayout_5.addWidget(self.chk_ExportOptionsReconcileTotals, 4, 1, 1, 1)
+        self.label_38 = QtWidgets.QLabel(self.gridLayoutWidget_5)
+        self.label_38.setObjectName("label_38")
+        self.gridLayout_5.addWidget(self.label_38, 5, 0, 1, 1)
+        self.combo_ExportOptionsFileFormat = QtWidgets.QComboBox(self.gridLayoutWidget_5)
+        self.combo_ExportOptionsFileFormat.setObjectName("combo_ExportOptionsFileFormat")
+        self.combo_ExportOptionsFileFormat.addItem("")
+        self.combo_ExportOptionsFileFormat.addItem("")
+        self.combo_ExportOptionsFileFormat.addItem("")
+        self.gridLayout_5.addWidget(self.combo_ExportOptionsFileFormat, 5, 1, 1, 1)
         self.label_23 = QtWidgets.QLabel(self.tab_ExportOptions)
         self.label_23.setGeometry(QtCore.QRect(10, 10, 251, 16))
         self.label_23.setObjectName("label_23")
@@ -498,9 +516,13 @@ class Ui_MainWindow(object):
         self.label_VersionInfo.setGeometry(QtCore.QRect(10, 10, 601, 20))
         self.label_VersionInfo.setObjectName("label_VersionInfo")
         self.tabs.addTab(self.tab_License, "")
-        self.txtb_SyncLog = QtWidgets.QTextEdit(self.centralWidget)
-        self.txtb_SyncLog.setGeometry(QtCore.QRect(10, 50, 641, 111))
-        self.txtb_SyncLog.setObjectName("txtb_SyncLog")
+        self.list_SyncLog = QtWidgets.QListView(self.centralWidget)
+        self.list_SyncLog.setGeometry(QtCore.QRect(10, 50, 641, 111))
+        self.list_SyncLog.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.list_SyncLog.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.list_SyncLog.setWordWrap(False)
+        self.list_SyncLog.setUniformItemSizes(True)
+        self.list_SyncLog.setObjectName("list_SyncLog")
         self.lbl_Icon = QtWidgets.QLabel(self.centralWidget)
         self.lbl_Icon.setGeometry(QtCore.QRect(79, 10, 571, 461))
         self.lbl_Icon.setObjectName("lbl_Icon")
@@ -519,6 +541,16 @@ class Ui_MainWindow(object):
         self.label_28.setText("")
         self.label_28.setObjectName("label_28")
         self.horizontalLayout_2.addWidget(self.label_28)
+        self.line_LogSearch = QtWidgets.QLineEdit(self.horizontalLayoutWidget_2)
+        self.line_LogSearch.setClearButtonEnabled(True)
+        self.line_LogSearch.setObjectName("line_LogSearch")
+        self.horizontalLayout_2.addWidget(self.line_LogSearch)
+        self.combo_LogLevel = QtWidgets.QComboBox(self.horizontalLayoutWidget_2)
+        self.combo_LogLevel.setObjectName("combo_LogLevel")
+        self.combo_LogLevel.addItem("")
+        self.combo_LogLevel.addItem("")
+        self.combo_LogLevel.addItem("")
+        self.horizontalLayout_2.addWidget(self.combo_LogLevel)
         self.btn_OpenLog = QtWidgets.QPushButton(self.horizontalLayoutWidget_2)
         self.btn_OpenLog.setObjectName("btn_OpenLog")
         self.horizontalLayout_2.addWidget(self.btn_OpenLog)
@@ -528,7 +560,7 @@ class Ui_MainWindow(object):
         self.progressBar.setObjectName("progressBar")
         self.lbl_Icon.raise_()
         self.tabs.raise_()
-        self.txtb_SyncLog.raise_()
+        self.list_SyncLog.raise_()
         self.horizontalLayoutWidget_2.raise_()
         self.progressBar.raise_()
         MainWindow.setCentralWidget(self.centralWidget)
@@ -599,8 +631,8 @@ class Ui_MainWindow(object):
         self.label_29.setText(_translate("MainWindow", "Shop"))
         self.label_12.setText(_translate("MainWindow", "Begin Date Range"))
         self.dateEdit_BeginExportRange.setDisplayFormat(_translate("MainWindow", "yyyy-MM-dd"))
-        self.combo_CustomerType.setToolTip(_translate("MainWindow", "Select customer type to export."))
-        self.combo_CustomerType.setStatusTip(_translate("MainWindow", "Select customer type to export."))
+        self.list_CustomerType.setToolTip(_translate("MainWindow", "Select customer types to export."))
+        self.list_CustomerType.setStatusTip(_translate("MainWindow", "Select customer types to export."))
         self.btn_ExportFolderPicker.setText(_translate("MainWindow", "Export Folder"))
         self.dateEdit_EndExportRange.setDisplayFormat(_translate("MainWindow", "yyyy-MM-dd"))
         self.label_30.setText(_translate("MainWindow", "Clear Charges as Employee"))
@@ -620,6 +652,11 @@ class Ui_MainWindow(object):
         self.label_25.setText(_translate("MainWindow", "Transaction_Type"))
         self.label_24.setText(_translate("MainWindow", "Trasaction_Source"))
         self.label_21.setText(_translate("MainWindow", "Catalog_Item_fk"))
+        self.label_37.setText(_translate("MainWindow", "Reconcile Line Totals to Invoice"))
+        self.label_38.setText(_translate("MainWindow", "Export File Format"))
+        self.combo_ExportOptionsFileFormat.setItemText(0, _translate("MainWindow", "CSV"))
+        self.combo_ExportOptionsFileFormat.setItemText(1, _translate("MainWindow", "XLSX"))
+        self.combo_ExportOptionsFileFormat.setItemText(2, _translate("MainWindow", "Parquet"))
         self.label_23.setText(_translate("MainWindow", "Additional Veracross Import File Fields"))
         self.btn_SaveExportOptions.setText(_translate("MainWindow", "Save"))
         self.label_20.setText(_translate("MainWindow", "<html><head/><body><p><a href=\"https://modules.veracross.com/article/how-to-import-person-charge-items\"><span style=\" text-decoration: underline; color:#0000ff;\">Importing Charge Items to Veracross</span></a></p></body></html>"))
@@ -648,6 +685,10 @@ class Ui_MainWindow(object):
         self.tabs.setTabText(self.tabs.indexOf(self.tab_License), _translate("MainWindow", "License"))
         self.lbl_Icon.setText(_translate("MainWindow", "icon"))
         self.lbl_SyncLog.setText(_translate("MainWindow", "<html><head/><body><p><br/></p></body></html>"))
+        self.line_LogSearch.setPlaceholderText(_translate("MainWindow", "Search Log"))
+        self.combo_LogLevel.setItemText(0, _translate("MainWindow", "All"))
+        self.combo_LogLevel.setItemText(1, _translate("MainWindow", "Info"))
+        self.combo_LogLevel.setItemText(2, _translate("MainWindow", "Debug"))
         self.btn_OpenLog.setText(_translate("MainWindow", "Open Log"))
         self.menuFile.setTitle(_translate("MainWindow", "File"))
         self.actionQuit.setText(_translate("MainWindow", "Quit"))
@@ -0,0 +1,148 @@
+import os
+import json
+import sqlite3
+import datetime
+import contextlib
+import config
+import lsapi
+
+# Cached reference data is used without asking Lightspeed until it is this old.
+REFERENCE_TTL = datetime.timedelta(hours=12)
+
+# Cached reference data is downloaded in full again once the last full download is this old, so records
+# deleted in Lightspeed are dropped too.
+REFERENCE_FULL_REFRESH = datetime.timedelta(days=7)
+
+
+def default_path(account_id, profile=None):
+    """
+    Location of the reference data cache for a Lightspeed account. Kept next to the settings file.
+    Each profile other than the default has its own, so profiles of the same account never share one.
+    :param account_id: Lightspeed account id
+    :param profile: settings profile name
+    :return: path to sqlite database
+    """
+    name = "lightspeed-vc-connector-reference-%s.db" % account_id
+    if profile is not None and profile != config.DEFAULT_PROFILE:
+        name = "lightspeed-vc-connector-reference-%s-%s.db" % (account_id, config.check_profile_name(profile))
+    return os.path.join(os.path.dirname(config.config_file_location()), name)
+
+
+def newest_timestamp(records):
+    """
+    Latest timeStamp of a list of records.
+    :param records: Lightspeed records
+    :return: timeStamp, or None when the records have none
+    """
+    stamps = [i['timeStamp'] for i in records if i.get('timeStamp')]
+    if not stamps:
+        return None
+    return max(stamps, key=datetime.datetime.fromisoformat)
+
+
+class ReferenceCache:
+    """
+    Local copy of Lightspeed reference data such as shops and customer types, which rarely changes.
+    Stale entries are revalidated by asking only for records changed since the newest cached timeStamp,
+    archived ones included, and are downloaded in full again every REFERENCE_FULL_REFRESH.
+    """
+
+    def __init__(self, path, ttl=REFERENCE_TTL, full_refresh=REFERENCE_FULL_REFRESH):
+        self.path = path
+        self.ttl = ttl
+        self.full_refresh = full_refresh
+
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS reference ("
+                       "source TEXT PRIMARY KEY, "
+                       "fetched TEXT, "
+                       "newest TEXT, "
+                       "data TEXT, "
+                       "full TEXT)")
+            # Caches written before full downloads were recorded.
+            if "full" not in [r[1] for r in db.execute("PRAGMA table_info(reference)")]:
+                db.execute("ALTER TABLE reference ADD COLUMN full TEXT")
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Open the cache for one transaction.
+        :return: sqlite connection, committed and closed on exit
+        """
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def entry(self, source):
+        with self.connect() as db:
+            return db.execute("SELECT fetched, newest, data, full FROM reference WHERE source = ?",
+                              (source,)).fetchone()
+
+    def get(self, source):
+        """
+        Cached records of a source, however old.
+        :param source: Lightspeed source such as Shop
+        :return: list of records, or None when nothing is cached
+        """
+        r = self.entry(source)
+        if r is None:
+            return None
+        return json.loads(r[2])
+
+    def is_fresh(self, source):
+        """
+        Check the cached records of a source are younger than the TTL.
+        :param source: Lightspeed source such as Shop
+        :return: True/False
+        """
+        r = self.entry(source)
+        if r is None:
+            return False
+        return datetime.datetime.now() - datetime.datetime.fromisoformat(r[0]) < self.ttl
+
+    def store(self, source, records, changed=()):
+        """
+        Cache a full download of a source.
+        :param source: Lightspeed source such as Shop
+        :param records: current records
+        :param changed: changed records found while revalidating, which may be archived and not in records
+        :return:
+        """
+        now = datetime.datetime.now().isoformat()
+        # An archived record is not downloaded again, but its change must not be found again either.
+        newest = newest_timestamp(list(records) + list(changed))
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO reference (source, fetched, newest, data, full) VALUES (?, ?, ?, ?, ?)",
+                       (source, now, newest, json.dumps(records), now))
+
+    def touch(self, source):
+        with self.connect() as db:
+            db.execute("UPDATE reference SET fetched = ? WHERE source = ?",
+                       (datetime.datetime.now().isoformat(), source))
+
+    def refresh(self, ls, source):
+        """
+        Revalidate the cached records of a source with Lightspeed.
+        When the cache has a timeStamp only changed records are asked for, archived ones included so
+        archiving a record counts as a change. The full list of current records is downloaded again when
+        something changed, or when the last full download is older than full_refresh.
+        :param ls: Lightspeed API client
+        :param source: Lightspeed source such as Shop
+        :return: list of current records
+        """
+        changed = []
+        r = self.entry(source)
+        if r is not None and r[1] is not None and r[3] is not None and \
+                datetime.datetime.now() - datetime.datetime.fromisoformat(r[3]) < self.full_refresh:
+            changed = lsapi.get_records(ls, source, parameters={'timeStamp': '>,{}'.format(r[1]),
+                                                                'archived': 'true'})
+            if not changed:
+                self.touch(source)
+                return json.loads(r[2])
+
+        records = lsapi.get_records(ls, source)
+        self.store(source, records, changed)
+        return records
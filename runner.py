@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import getpass
+import logging
+import argparse
+import datetime
+import traceback
+import concurrent.futures
+import config
+
+# Jobs the runner can run for each profile, in the order they run.
+JOB_NAMES = ["sync", "export"]
+
+# Environment variable holding the settings password, so nightly runs need no prompt.
+PASSWORD_ENV = "LSVC_PASSWORD"
+
+
+def log_file(profile):
+    """
+    Location of the log of a profile's run, next to the window's log.
+    :param profile: profile name
+    :return: path to log file
+    """
+    name = "LSVCConnectorLog-" + config.check_profile_name(profile) + "-" + str(datetime.date.today()) + ".txt"
+    try:
+        return os.path.join(os.environ['TEMP'], name)
+    except KeyError:
+        return os.path.join("/tmp", name)
+
+
+def profile_logger(profile, debug):
+    """
+    Log method for a profile's jobs, taking text and level like Main.debug_append_log.
+    Window messages are also printed, prefixed with the profile name.
+    :param profile: profile name
+    :param debug: write debug messages too
+    :return: log method
+    """
+    logger = logging.getLogger("lsvc." + profile)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.FileHandler(log_file(profile))
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        logger.addHandler(handler)
+
+    def log(text, level):
+        if "window" in level:
+            print("[%s] %s" % (profile, text), flush=True)
+        if "info" in level or ("debug" in level and debug):
+            logger.warning(text)
+
+    return log
+
+
+def export_options(settings, options):
+    """
+    Export options for a profile. Anything not given on the command line comes from the profile's
+    export settings.
+    :param settings: settings profile
+    :param options: options from the command line
+    :return: options for Job.export_charges
+    """
+    today = datetime.date.today()
+    export = {
+        'shop': None,
+        'customer_types': None,
+        'begin_date': today,
+        'end_date': today,
+        'export_folder': None,
+        'debug': settings.get("debug_export", False),
+        'reconcile': settings.get("vc_export_reconcile_totals", False),
+        'file_format': settings.get("vc_export_file_format", "CSV"),
+        'transaction_source': settings.get("vc_export_transaction_source", ""),
+        'transaction_type': settings.get("vc_export_transaction_type", ""),
+        'school_year': settings.get("vc_export_school_year", ""),
+        'catalog_item_fk': settings.get("vc_export_catalog_item_fk", "")
+    }
+    export.update(dict((k, v) for k, v in options.items() if v is not None))
+    return export
+
+
+def run_profile(profile, password, job_names, options, config_path=None):
+    """
+    Run jobs for one profile. Runs in its own process with its own clients, rate limit and log.
+    :param profile: profile name
+    :param password: settings password
+    :param job_names: names from JOB_NAMES
+    :param options: sync and export options from the command line
+    :param config_path: settings location, when not the default
+    :return: tuple of profile name and True when every job finished
+    """
+    import jobs
+
+    if config_path:
+        config.set_config_file(config_path)
+
+    settings = config.load_profile(profile, password)
+    log = profile_logger(profile, settings.get("debug_export", False))
+
+    try:
+        job = jobs.Job.from_settings(settings, password, log, profile=profile)
+        job.load_reference()
+
+        if "sync" in job_names:
+            log("Sync started.", "window,info")
+            job.sync_customers({
+                'user_type': options.get('user_type'),
+                'grade_level': "None",
+                'force_sync': False,
+                'updated_after': options.get('updated_after')
+            })
+            log("User Sync Complete.", "window,info")
+
+        if "export" in job_names:
+            export = export_options(settings, options)
+            # Every shop and customer type unless narrowed on the command line. The runner never
+            # clears balances.
+            if export['shop'] is None:
+                export['shop'] = jobs.ALL_SHOPS if len(job.ls_shops) > 1 else next(iter(job.ls_shops))
+            if export['customer_types'] is None:
+                export['customer_types'] = list(job.ls_customer_types.keys())
+            job.export_charges(export)
+            log("Export Complete.", "window,info")
+    except:
+        log("Run failed.", "window,info")
+        log(traceback.format_exc(), "info")
+        return profile, False
+
+    return profile, True
+
+
+def run_profiles(profiles, password, job_names, options, config_path=None, workers=None):
+    """
+    Run jobs for several profiles in parallel worker processes.
+    :param profiles: profile names
+    :param password: settings password
+    :param job_names: names from JOB_NAMES
+    :param options: sync and export options from the command line
+    :param config_path: settings location, when not the default
+    :param workers: most processes at once, one per profile when not given
+    :return: dictionary of profile name and True when every job finished
+    """
+    results = dict()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers or len(profiles)) as pool:
+        futures = dict((pool.submit(run_profile, p, password, job_names, options, config_path), p)
+                       for p in profiles)
+        for f in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[f]] = f.result()[1]
+            except Exception as e:
+                # The profile could not be loaded, so it has no log of its own.
+                print("[%s] %s" % (futures[f], repr(e)), flush=True)
+                results[futures[f]] = False
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sync and export jobs for settings profiles.")
+    parser.add_argument("--config", help="settings location, overrides the %s environment variable" %
+                                         config.CONFIG_ENV)
+    parser.add_argument("--profile", action="append",
+                        help="profile to run, may be repeated. Every profile runs when not given")
+    parser.add_argument("--jobs", default=",".join(JOB_NAMES), help="comma separated jobs from %s" %
+                                                                    ", ".join(JOB_NAMES))
+    parser.add_argument("--user-type", default="Students", choices=["Students", "Faculty Staff"],
+                        help="Veracross users to sync")
+    parser.add_argument("--updated-after", type=datetime.date.fromisoformat,
+                        help="only sync Veracross records changed on or after this date")
+    parser.add_argument("--begin", type=datetime.date.fromisoformat, help="first day to export, today by default")
+    parser.add_argument("--end", type=datetime.date.fromisoformat, help="last day to export, today by default")
+    parser.add_argument("--export-folder", help="folder export files are written to")
+    parser.add_argument("--customer-type", action="append",
+                        help="customer type to export, may be repeated. Every type is exported when not given")
+    parser.add_argument("--workers", type=int, help="most profiles to run at once")
+    parser.add_argument("--list-profiles", action="store_true", help="list the settings profiles and exit")
+    parser.add_argument("--add-profile", nargs=2, metavar=("NAME", "FILE"),
+                        help="add or replace a profile from a file saved with Export Settings and exit")
+    args = parser.parse_args()
+
+    # Profile names are used in file names.
+    names = (args.profile or []) + (args.add_profile[:1] if args.add_profile else [])
+    invalid = [p for p in names if not config.PROFILE_NAME.fullmatch(p)]
+    if invalid:
+        parser.error("profile names may only use letters, digits, _ and -: %s" % ", ".join(invalid))
+
+    if args.config:
+        config.set_config_file(args.config)
+
+    password = os.environ.get(PASSWORD_ENV) or getpass.getpass("Settings password: ")
+
+    # Open the settings once here, so older settings are migrated before any worker process reads them.
+    config.open_store(password)
+
+    if args.list_profiles:
+        for name in config.list_profiles(password):
+            print(name)
+        return 0
+
+    if args.add_profile:
+        name, path = args.add_profile
+        with open(path, "r") as infile:
+            config.save_profile(json.load(infile), name, password)
+        return 0
+
+    job_names = [j.strip() for j in args.jobs.split(",") if j.strip()]
+    unknown = [j for j in job_names if j not in JOB_NAMES]
+    if unknown:
+        parser.error("unknown jobs: %s" % ", ".join(unknown))
+
+    if "export" in job_names and not args.export_folder:
+        parser.error("--export-folder is required to export")
+
+    profiles = args.profile or config.list_profiles(password)
+    options = {
+        'user_type': args.user_type,
+        'updated_after': args.updated_after,
+        'begin_date': args.begin,
+        'end_date': args.end,
+        'export_folder': args.export_folder,
+        'customer_types': args.customer_type
+    }
+
+    results = run_profiles(profiles, password, job_names, options, config_path=config.config_file_location(),
+                           workers=args.workers)
+    for profile in profiles:
+        print("%s: %s" % (profile, "finished" if results.get(profile) else "failed"))
+    return 0 if all(results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
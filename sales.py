@@ -0,0 +1,334 @@
+import datetime
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+import pandas
+import currency
+import lsapi
+
+# Number of date shards fetched from Lightspeed at the same time.
+SHARD_WORKERS = 4
+
+# Number of sales flattened and written to the export file at a time.
+CHUNK_SALES = 500
+
+# Lightspeed payment type code for payments made on a customer credit account.
+ON_ACCOUNT_CODE = 'SCA'
+
+# Sale classifications returned by classify_sale.
+ON_ACCOUNT = "on_account"
+MIXED = "mixed"
+NOT_ON_ACCOUNT = "not_on_account"
+EXCLUDED = "excluded"
+
+
+def sale_query_parameters(begin_date, end_date, utc_offset_iso, shop_id=None, customer_type_id=None):
+    """
+    Build the Lightspeed query parameters for completed sales in a date range.
+    Shop and customer type constraints are pushed to the API so only matching sales are downloaded.
+    :param begin_date: first day of the export range
+    :param end_date: last day of the export range
+    :param utc_offset_iso: shop utc offset formatted as -04:00
+    :param shop_id: optional shopID to filter sales to
+    :param customer_type_id: optional customerTypeID to filter sales to
+    :return: dictionary of url parameters
+    """
+    parameters = {}
+    parameters['load_relations'] = 'all'
+    parameters['completed'] = 'true'
+    parameters['timeStamp'] = '{},{}T00:00:00{},{}T23:59:59{}'.format("><",
+                                                                    begin_date,
+                                                                    utc_offset_iso,
+                                                                    end_date,
+                                                                    utc_offset_iso)
+
+    # Sale has its own shopID field so the API filters on it directly.
+    if shop_id is not None:
+        parameters['shopID'] = str(shop_id)
+
+    # Customer type lives on the Customer relation. Lightspeed filters on fields of a loaded relation
+    # with dot notation.
+    if customer_type_id is not None:
+        parameters['Customer.customerTypeID'] = str(customer_type_id)
+
+    return parameters
+
+
+def sale_payments(sale):
+    """
+    SalePayment records of a sale.
+    :param sale: Sale record normalized by lsapi
+    :return: list of SalePayment records
+    """
+    return sale.get('SalePayments', {}).get('SalePayment', [])
+
+
+def classify_sale(sale, shop_ids=None, customer_type_ids=None):
+    """
+    Classify a sale for the charge export in one pass over its payments.
+    The shop and customer type are checked before the payments are looked at.
+    :param sale: Sale record from Lightspeed
+    :param shop_ids: optional shopIDs the sale must belong to
+    :param customer_type_ids: optional customerTypeIDs the sale customer must have
+    :return: EXCLUDED, NOT_ON_ACCOUNT, MIXED or ON_ACCOUNT
+    """
+    if shop_ids is not None and str(sale.get('shopID')) not in {str(i) for i in shop_ids}:
+        return EXCLUDED
+
+    if customer_type_ids is not None:
+        if 'Customer' not in sale or \
+                str(sale['Customer'].get('customerTypeID')) not in {str(i) for i in customer_type_ids}:
+            return EXCLUDED
+
+    on_account = False
+    other = False
+    for p in sale_payments(sale):
+        if p.get('PaymentType', {}).get('code') == ON_ACCOUNT_CODE:
+            on_account = True
+        else:
+            other = True
+
+    if not on_account:
+        return NOT_ON_ACCOUNT
+    if other:
+        return MIXED
+    return ON_ACCOUNT
+
+
+def date_shards(begin_date, end_date, workers=SHARD_WORKERS):
+    """
+    Split an inclusive date range into consecutive windows.
+    Short ranges get one window per day, long ranges are grouped so there are a few windows per worker.
+    :param begin_date: first day of the range
+    :param end_date: last day of the range
+    :param workers: number of windows fetched at the same time
+    :return: list of (begin, end) date tuples
+    """
+    total_days = (end_date - begin_date).days + 1
+    days_per_shard = max(1, math.ceil(total_days / (workers * 4)))
+
+    shards = []
+    shard_begin = begin_date
+    while shard_begin <= end_date:
+        shard_end = min(shard_begin + datetime.timedelta(days=days_per_shard - 1), end_date)
+        shards.append((shard_begin, shard_end))
+        shard_begin = shard_end + datetime.timedelta(days=1)
+    return shards
+
+
+def fetch_sales(ls, begin_date, end_date, utc_offset_iso, shop_id=None, customer_type_id=None,
+                workers=SHARD_WORKERS):
+    """
+    Get completed sales for a date range by fetching date shards concurrently.
+    All shards share the Lightspeed client and its rate limiter, which reserves bucket room for each
+    request under a lock. A shard that cannot be fetched raises instead of returning fewer sales.
+    :param ls: Lightspeed API client
+    :param begin_date: first day of the export range
+    :param end_date: last day of the export range
+    :param utc_offset_iso: shop utc offset formatted as -04:00
+    :param shop_id: optional shopID to filter sales to
+    :param customer_type_id: optional customerTypeID to filter sales to
+    :param workers: number of shards fetched at the same time
+    :return: list of sales ordered by timeStamp
+    """
+
+    def fetch_shard(shard):
+        parameters = sale_query_parameters(shard[0], shard[1], utc_offset_iso,
+                                           shop_id=shop_id, customer_type_id=customer_type_id)
+        return lsapi.get_records(ls, "Sale", parameters=parameters)
+
+    # Refresh the token once up front instead of from every shard.
+    ls.get_token()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(fetch_shard, date_shards(begin_date, end_date, workers))
+
+        merged = dict()
+        for shard_sales in results:
+            for i in shard_sales:
+                merged[i['saleID']] = i
+
+    return sorted(merged.values(), key=lambda i: datetime.datetime.fromisoformat(i['timeStamp']))
+
+
+SALE_COLUMNS = ['saleID',
+                'timeStamp',
+                'shopID',
+                'Customer.customerTypeID',
+                'Customer.companyRegistrationNumber',
+                'Customer.firstName',
+                'Customer.lastName']
+
+SALELINE_COLUMNS = ['saleLineID',
+                    'shopID',
+                    'unitQuantity',
+                    'unitPrice',
+                    'calcLineDiscount',
+                    'displayableSubtotal',
+                    'calcTax1',
+                    'calcTotal',
+                    'Item.description',
+                    'Note.note']
+
+SALELINE_EXPORT_COLUMNS = ['person_id',
+                           'customer_account_number',
+                           'customer_name',
+                           'transaction_source',
+                           'transaction_type',
+                           'school_year',
+                           'item_date',
+                           'catalog_item_fk',
+                           'description',
+                           'quantity',
+                           'unit_price',
+                           'purchase_amount',
+                           'tax_amount',
+                           'total_amount',
+                           'pos_transaction_id']
+
+
+def chunks(iterable, size=CHUNK_SALES):
+    """
+    Group an iterable into lists of at most size items.
+    :param iterable: items to group
+    :param size: items per list
+    :return: generator of lists
+    """
+    chunk = []
+    for i in iterable:
+        chunk.append(i)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def saleline_export_columns(debug=False):
+    """
+    Header of the sale line export.
+    :param debug: include debug_timestamp and debug_shopID columns
+    :return: list of column names
+    """
+    if debug:
+        return SALELINE_EXPORT_COLUMNS + ['debug_timestamp', 'debug_shopID']
+    return list(SALELINE_EXPORT_COLUMNS)
+
+
+def saleline_frame(sale_list):
+    """
+    Flatten the sale lines of a list of sales into one row per line.
+    Sale fields are repeated onto each line with a "sale." prefix.
+    :param sale_list: Sale records from Lightspeed
+    :return: DataFrame
+    """
+    line_lists = [i.get('SaleLines', {}).get('SaleLine', []) for i in sale_list]
+
+    counts = [len(lines) for lines in line_lists]
+
+    flat = [line for lines in line_lists for line in lines]
+    lines = pandas.json_normalize(flat, max_level=1)
+    lines = lines.reindex(columns=SALELINE_COLUMNS)
+    # An Item without a description still counts as an item.
+    lines['hasItem'] = [('Item' in line) for line in flat]
+
+    sale_info = pandas.json_normalize(sale_list, max_level=1).reindex(columns=SALE_COLUMNS)
+    sale_info = sale_info.loc[sale_info.index.repeat(counts)].reset_index(drop=True).add_prefix('sale.')
+    sale_info['sale.lineCount'] = numpy.repeat(counts, counts)
+
+    return pandas.concat([lines, sale_info], axis=1)
+
+
+def shop_window_lines(lines, shop_id, begin_date, end_date, utc_offset_iso):
+    """
+    Lines from one shop whose sale falls inside the date range in that shop's timezone.
+    Used to partition one pass over all shops into per-shop exports.
+    :param lines: DataFrame from saleline_frame
+    :param shop_id: shopID of the lines to keep
+    :param begin_date: first day of the export range
+    :param end_date: last day of the export range
+    :param utc_offset_iso: shop utc offset formatted as -04:00
+    :return: DataFrame
+    """
+    begin = pandas.Timestamp('{}T00:00:00{}'.format(begin_date, utc_offset_iso))
+    end = pandas.Timestamp('{}T23:59:59{}'.format(end_date, utc_offset_iso))
+    sale_time = pandas.to_datetime(lines['sale.timeStamp'], utc=True)
+    return lines[(lines['shopID'].astype(str) == str(shop_id)) & (sale_time >= begin) & (sale_time <= end)]
+
+
+def saleline_export_frame(lines, shop_id, options, debug=False, reconcile=False):
+    """
+    Compute the Veracross export rows for flattened sale lines.
+    Currency math is done in exact thousandths of a cent. The amounts are rounded half up to cents, while
+    unit_price keeps Lightspeed's precision, as the unit price less the line discount per unit. Lines with a missing or invalid quantity or amount are
+    returned as failed instead of being exported.
+    :param lines: DataFrame from saleline_frame
+    :param shop_id: only lines from this shop are exported
+    :param options: dictionary with transaction_source, transaction_type, school_year and catalog_item_fk
+    :param debug: add debug_timestamp and debug_shopID columns
+    :param reconcile: round subtotals and taxes so the lines of each sale add up to the rounded sale
+                      totals. Each line total is then its subtotal plus tax
+    :return: tuple of export DataFrame and DataFrame of lines that could not be computed
+    """
+    # Single line sales without an item are balance clears and misc charges.
+    keep = (lines['shopID'].astype(str) == str(shop_id)) & (lines['hasItem'] | (lines['sale.lineCount'] > 1))
+    lines = lines[keep]
+
+    quantity = pandas.to_numeric(lines['unitQuantity'], errors='coerce')
+    amounts = pandas.DataFrame({
+        'unit_price': currency.parse(lines['unitPrice']),
+        'discount': currency.parse(lines['calcLineDiscount']),
+        'subtotal': currency.parse(lines['displayableSubtotal']),
+        'tax': currency.parse(lines['calcTax1']),
+        'total': currency.parse(lines['calcTotal'])
+    })
+
+    valid = quantity.notna() & (quantity != 0) & amounts.notna().all(axis=1)
+    failed = lines[~valid]
+    lines = lines[valid]
+
+    quantity = quantity[valid].astype('int64')
+    amounts = amounts[valid].astype('int64')
+
+    if reconcile:
+        # The total is derived so each line still adds up: subtotal + tax = total.
+        sale_id = lines['sale.saleID']
+        subtotal = currency.reconcile(amounts['subtotal'], sale_id)
+        tax = currency.reconcile(amounts['tax'], sale_id)
+        total = subtotal + tax
+    else:
+        subtotal = currency.round_half_up(amounts['subtotal'])
+        tax = currency.round_half_up(amounts['tax'])
+        total = currency.round_half_up(amounts['total'])
+
+    # Not rounded to cents, a discount spread over several units can leave fractions of a cent.
+    unit_price = currency.div_round_half_up(amounts['unit_price'] * quantity - amounts['discount'], quantity)
+
+    # The item description, or the note of a line without an item.
+    description = lines['Item.description'].where(lines['hasItem'], lines['Note.note']).fillna("Unknown").astype(str)
+    customer = lines['sale.Customer.companyRegistrationNumber'].astype(str)
+
+    export = pandas.DataFrame({
+        'person_id': customer,
+        'customer_account_number': customer,
+        'customer_name': lines['sale.Customer.firstName'].astype(str) + " " +
+                         lines['sale.Customer.lastName'].astype(str),
+        'transaction_source': options['transaction_source'],
+        'transaction_type': options['transaction_type'],
+        'school_year': options['school_year'],
+        'item_date': lines['sale.timeStamp'].astype(str).str[:10],
+        'catalog_item_fk': options['catalog_item_fk'],
+        'description': description,
+        'quantity': lines['unitQuantity'].astype(str),
+        'unit_price': currency.to_string(unit_price, currency.PLACES, min_places=2),
+        'purchase_amount': currency.to_string(subtotal),
+        'tax_amount': currency.to_string(tax),
+        'total_amount': currency.to_string(total),
+        'pos_transaction_id': lines['sale.saleID'].astype(str)
+    }, columns=SALELINE_EXPORT_COLUMNS)
+
+    if debug:
+        export['debug_timestamp'] = lines['sale.timeStamp'].astype(str)
+        export['debug_shopID'] = lines['sale.shopID'].astype(str)
+
+    return export, failed
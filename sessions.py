@@ -0,0 +1,51 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Hosts kept in the connection pool, Lightspeed, Veracross and GitHub.
+POOL_CONNECTIONS = 4
+
+# Open connections kept per host. Covers the export shard and clearing worker pools.
+POOL_MAXSIZE = 16
+
+_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def shared_adapter():
+    """
+    Connection pool shared by every HTTP session in the app, so connections are kept alive and reused
+    across clients and threads.
+    :return: requests HTTPAdapter
+    """
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        return _adapter
+
+
+def pooled_session(headers=None):
+    """
+    New session that sends its requests through the shared connection pool.
+    Each client gets its own session so its Authorization header is kept separate.
+    :param headers: headers to copy onto the session
+    :return: requests Session
+    """
+    session = requests.Session()
+    session.mount("https://", shared_adapter())
+    session.mount("http://", shared_adapter())
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def attach(client):
+    """
+    Replace the session of an API client with one on the shared connection pool.
+    Headers already set on the client session, such as Accept and Authorization, are kept.
+    :param client: Lightspeed or Veracross client
+    :return: the client
+    """
+    client.session = pooled_session(client.session.headers)
+    return client
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pandas
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import currency
+
+
+def amounts(*values):
+    return pandas.Series(values, dtype='int64')
+
+
+def test_parse_decimal_strings():
+    parsed = currency.parse(pandas.Series([".5", "-.5", "1.23456", "-12.50", "7", " 3.1 ", None]))
+    assert parsed[:6].tolist() == [50000, -50000, 123456, -1250000, 700000, 310000]
+    assert pandas.isna(parsed[6])
+
+
+def test_parse_junk_is_missing():
+    parsed = currency.parse(pandas.Series(["abc", "1.2x", "1-2", "--1", "-", ".", ""]))
+    assert parsed.isna().all()
+
+    with pytest.raises(ValueError):
+        currency.Currency.parse("abc")
+    assert currency.Currency.parse("-.5") == currency.Currency(-50000)
+
+
+def test_round_half_up_ties_away_from_zero():
+    # 0.005, 0.015, 0.004999 and their negatives, in thousandths of a cent.
+    values = amounts(500, 1500, 499, -500, -1500, -499)
+    assert currency.round_half_up(values).tolist() == [1, 2, 0, -1, -2, 0]
+
+    assert currency.div_round_half_up(5, 2) == 3
+    assert currency.div_round_half_up(-5, 2) == -3
+    assert currency.div_round_half_up(5, -2) == -3
+
+
+def test_reconcile_adds_missing_cent():
+    # 0.333 + 0.334 + 0.333 = 1.00, the lines round to 0.99.
+    values = amounts(33300, 33400, 33300, -33300, -33400, -33300)
+    groups = pandas.Series([1, 1, 1, 2, 2, 2])
+    assert currency.reconcile(values, groups).tolist() == [33, 34, 33, -33, -34, -33]
+
+
+def test_reconcile_removes_extra_cent():
+    # 0.335 + 0.336 + 0.335 = 1.006 rounds to 1.01, the lines round to 1.02.
+    values = amounts(33500, 33600, 33500, -33500, -33600, -33500)
+    groups = pandas.Series([1, 1, 1, 2, 2, 2])
+    reconciled = currency.reconcile(values, groups)
+    assert reconciled.tolist() == [33, 34, 34, -33, -34, -34]
+    assert reconciled.groupby(groups).sum().tolist() == [101, -101]
+
+
+def test_to_string_keeps_precision_down_to_cents():
+    values = amounts(201000, 200500, -50, 0, 96667)
+    assert currency.to_string(values, currency.PLACES, min_places=2).tolist() == \
+        ['2.01', '2.005', '-0.0005', '0.00', '0.96667']
+    assert currency.to_string(amounts(201, -5)).tolist() == ['2.01', '-0.05']
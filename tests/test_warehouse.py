@@ -0,0 +1,86 @@
+import os
+import sys
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sales
+import warehouse
+
+
+def sale(sale_id, timestamp, shop_id='1'):
+    return {'saleID': sale_id, 'shopID': shop_id, 'timeStamp': timestamp, 'Customer': {'customerTypeID': '1'}}
+
+
+def fake_lightspeed(monkeypatch, remote):
+    """
+    Replace sales.fetch_sales with one answering from a list of sales.
+    :return: list of (first day, last day, shop_id, customer_type_id) requested
+    """
+    requests = []
+
+    def fetch_sales(ls, begin_date, end_date, utc_offset_iso, shop_id=None, customer_type_id=None):
+        requests.append((begin_date, end_date, shop_id, customer_type_id))
+        return [i for i in remote
+                if begin_date <= datetime.date.fromisoformat(i['timeStamp'][:10]) <= end_date and
+                (shop_id is None or i['shopID'] == str(shop_id))]
+
+    monkeypatch.setattr(sales, 'fetch_sales', fetch_sales)
+    return requests
+
+
+def test_sale_after_empty_first_sync_is_fetched(tmp_path, monkeypatch):
+    today = datetime.date.today()
+    remote = []
+    requests = fake_lightspeed(monkeypatch, remote)
+
+    w = warehouse.SalesWarehouse(str(tmp_path / "sales.db"))
+
+    # First sync of the day, before any sale was completed.
+    assert w.sync(None, today, today, "+00:00") == 0
+
+    # A sale is completed, the next sync must pick it up.
+    remote.append(sale('1', '{}T00:00:01+00:00'.format(today)))
+    assert w.sync(None, today, today, "+00:00") == 1
+    assert requests[-1][:2] == (today, today)
+    assert [i['saleID'] for i in w.sales(today, today, "+00:00")] == ['1']
+
+
+def test_past_period_is_fetched_once_and_not_past_end_date(tmp_path, monkeypatch):
+    begin = datetime.date(2024, 3, 1)
+    end = datetime.date(2024, 3, 31)
+    remote = [sale('1', '2024-03-05T10:00:00+00:00'), sale('2', '2024-04-02T10:00:00+00:00')]
+    requests = fake_lightspeed(monkeypatch, remote)
+
+    w = warehouse.SalesWarehouse(str(tmp_path / "sales.db"))
+
+    assert w.sync(None, begin, end, "+00:00", shop_id='1') == 1
+    assert requests and all(r[1] <= end for r in requests)
+    assert all(r[2] == '1' for r in requests)
+
+    # The same export again needs nothing from Lightspeed.
+    del requests[:]
+    assert w.sync(None, begin, end, "+00:00", shop_id='1') == 0
+    assert requests == []
+
+    # A longer range only fetches the days not held yet.
+    assert w.sync(None, begin, datetime.date(2024, 4, 5), "+00:00", shop_id='1') == 1
+    assert requests == [(datetime.date(2024, 4, 1), datetime.date(2024, 4, 5), '1', None)]
+
+
+def test_coverage_is_kept_per_shop(tmp_path, monkeypatch):
+    day = datetime.date(2024, 3, 5)
+    requests = fake_lightspeed(monkeypatch, [])
+
+    w = warehouse.SalesWarehouse(str(tmp_path / "sales.db"))
+
+    # Holding one shop's sales does not cover another shop.
+    w.sync(None, day, day, "+00:00", shop_id='1')
+    w.sync(None, day, day, "+00:00", shop_id='2')
+    assert len(requests) == 2
+
+    # Holding every shop's sales covers each shop.
+    w.sync(None, day + datetime.timedelta(days=1), day + datetime.timedelta(days=1), "+00:00")
+    w.sync(None, day + datetime.timedelta(days=1), day + datetime.timedelta(days=1), "-04:00", shop_id='3')
+    assert requests[2:] == [(day + datetime.timedelta(days=1), day + datetime.timedelta(days=1), None, None),
+                            (day + datetime.timedelta(days=1), day + datetime.timedelta(days=1), '3', None)]
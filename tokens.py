@@ -0,0 +1,258 @@
+import os
+import json
+import datetime
+import threading
+import requests
+import lightspeed_api
+import veracross_api3 as veracross
+import config
+import crypto
+import lsapi
+
+# Tokens are refreshed this long before they expire, so a running job never holds an expired token.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+# Longest and shortest the background refresher sleeps between checks.
+REFRESH_CHECK_SECONDS = 60
+REFRESH_RETRY_SECONDS = 10
+
+
+def default_path(profile=None):
+    """
+    Location of the access token cache. Kept next to the settings file.
+    :param profile: settings profile name, each profile other than the default has its own cache
+    :return: path to encrypted token file
+    """
+    name = "lightspeed-vc-connector-tokens.aes"
+    if profile is not None and profile != config.DEFAULT_PROFILE:
+        name = "lightspeed-vc-connector-tokens-%s.aes" % config.check_profile_name(profile)
+    return os.path.join(os.path.dirname(os.path.abspath(config.config_file_location())), name)
+
+
+class TokenCache:
+    """
+    Access tokens encrypted on disk with the settings password, so they can be reused by the next run.
+    """
+
+    def __init__(self, path, password, log):
+        """
+        :param path: path to encrypted token file
+        :param password: settings password
+        :param log: method taking text and level, like Main.debug_append_log
+        """
+        self.path = path
+        self.password = password
+        self.key_cache = crypto.KeyCache()
+        self.log = log
+        self.lock = threading.Lock()
+        self.tokens = self.load()
+
+    def load(self):
+        """
+        Read the cached tokens. A missing or unreadable cache is treated as empty.
+        :return: dictionary of cached tokens
+        """
+        if not os.path.isfile(self.path):
+            return dict()
+        try:
+            with open(self.path, "rb") as f:
+                return json.loads(crypto.decrypt(f.read(), self.password, keys=self.key_cache).decode())
+        except (OSError, ValueError) as e:
+            self.log("Unable to read access token cache. %s" % e, "debug")
+            return dict()
+
+    def save(self):
+        """
+        Encrypt the tokens to a temporary file and move it into place.
+        :return: nothing
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(crypto.encrypt(json.dumps(self.tokens).encode(), self.password, keys=self.key_cache))
+        os.replace(temp_path, self.path)
+
+    def get(self, key):
+        """
+        Cached token that is not close to expiring.
+        :param key: client cache key
+        :return: tuple of token and expire time, or None
+        """
+        with self.lock:
+            entry = self.tokens.get(key)
+        if entry is None:
+            return None
+        expires = datetime.datetime.fromisoformat(entry["expires"])
+        if datetime.datetime.now() > expires - REFRESH_MARGIN:
+            return None
+        return entry["access_token"], expires
+
+    def set(self, key, token, expires):
+        """
+        Cache a new token.
+        :param key: client cache key
+        :param token: access token
+        :param expires: expire time
+        :return: nothing
+        """
+        with self.lock:
+            self.tokens[key] = {"access_token": token, "expires": expires.isoformat()}
+            try:
+                self.save()
+            except OSError as e:
+                # The token still works, it is only requested again by the next run.
+                self.log("Unable to save access token cache. %s" % e, "debug")
+
+
+class LightspeedClient(lightspeed_api.Lightspeed):
+    """
+    Lightspeed client that reuses cached access tokens and refreshes them before they expire.
+    """
+
+    def __init__(self, config, token_cache=None):
+        super().__init__(config)
+        self.token_cache = token_cache
+        self.token_lock = threading.Lock()
+        self.cache_key = "lightspeed-{}-{}".format(config.get("account_id", ""), config.get("client_id", ""))
+        # Shared by every thread using this client.
+        self.rate_limiter = lsapi.RateLimiter()
+
+        if token_cache is not None:
+            cached = token_cache.get(self.cache_key)
+            if cached is not None:
+                self.bearer_token, self.token_expire_time = cached
+                self.session.headers.update({'Authorization': 'Bearer ' + self.bearer_token})
+
+    def request_bucket(self, method, url, data=None):
+        """
+        Sends request to session through the rate limiter, which is safe to share between threads.
+        :param method: post, put, delete or get
+        :param url: complete api url
+        :param data: post/put data
+        :return: results in json, or None when Lightspeed did not answer 200
+        """
+        r = lsapi.send(self, method, url, data=data)
+        if r.status_code == 200:
+            return r.json()
+        return None
+
+    def get_token(self):
+        """
+        Ensures the Lightspeed HQ Bearer token is current, refreshing it shortly before it expires.
+        :return: bearer token
+        """
+        with self.token_lock:
+            if datetime.datetime.now() < self.token_expire_time - REFRESH_MARGIN:
+                return self.bearer_token
+
+            # Mark the token expired so the client refreshes it.
+            self.token_expire_time = datetime.datetime.now() - datetime.timedelta(days=1)
+            token = super().get_token()
+            if token is not None and self.token_cache is not None:
+                self.token_cache.set(self.cache_key, token, self.token_expire_time)
+            return token
+
+
+class VeracrossClient(veracross.Veracross):
+    """
+    Veracross client that reuses cached access tokens instead of requesting one for every call.
+    """
+
+    def __init__(self, config, token_cache=None):
+        super().__init__(config)
+        self.token_cache = token_cache
+        self.token_lock = threading.Lock()
+        self.cache_key = "veracross-{}-{}".format(self.school, self.client_id)
+
+        if token_cache is not None:
+            cached = token_cache.get(self.cache_key)
+            if cached is not None:
+                self.bearer_token, self.token_expire_time = cached
+                self.session.headers.update({'Authorization': 'Bearer ' + self.bearer_token})
+
+    def get_authorization_token(self):
+        """
+        Get / refresh bearer token from veracross api when it is close to expiring.
+        :return: string: bearer token
+        """
+        with self.token_lock:
+            if self.bearer_token and datetime.datetime.now() < self.token_expire_time - REFRESH_MARGIN:
+                return self.bearer_token
+
+            headers = {'Accept': 'application/json',
+                       'Content-Type': 'application/x-www-form-urlencoded',
+                       'Authorization': None}
+
+            try:
+                payload = {
+                    'client_id': self.client_id,
+                    'client_secret': self.client_secret,
+                    'grant_type': 'client_credentials',
+                    'scope': ' '.join(self.scopes)
+                }
+                r = self.session.post(self.token_url, data=payload, headers=headers)
+                data = r.json()
+
+                self.bearer_token = data["access_token"]
+                self.token_expire_time = datetime.datetime.now() + \
+                                         datetime.timedelta(seconds=int(data["expires_in"]))
+                self.session.headers.update({'Authorization': 'Bearer ' + self.bearer_token})
+
+                if self.token_cache is not None:
+                    self.token_cache.set(self.cache_key, self.bearer_token, self.token_expire_time)
+
+                return self.bearer_token
+            except Exception as e:
+                self.debug_log(str(e))
+                return None
+
+    def get_token(self):
+        return self.get_authorization_token()
+
+
+class TokenRefresher(threading.Thread):
+    """
+    Background thread that refreshes client tokens before they expire, so jobs never stall on a refresh.
+    """
+
+    def __init__(self, clients, log):
+        """
+        :param clients: Lightspeed and Veracross clients
+        :param log: method taking text and level, like Main.debug_append_log
+        """
+        super().__init__(daemon=True)
+        self.clients = clients
+        self.log = log
+        self.stopped = threading.Event()
+
+    def next_check(self):
+        """
+        Seconds until the next token is due for a refresh.
+        :return: seconds to sleep
+        """
+        wait = REFRESH_CHECK_SECONDS
+        for client in self.authorized():
+            due = (client.token_expire_time - REFRESH_MARGIN - datetime.datetime.now()).total_seconds()
+            wait = min(wait, max(due, REFRESH_RETRY_SECONDS))
+        return wait
+
+    def authorized(self):
+        """
+        Clients that have a token to keep fresh. Clients that never authorized are left alone.
+        :return: list of clients
+        """
+        return [c for c in self.clients if c.bearer_token]
+
+    def run(self):
+        while not self.stopped.wait(self.next_check()):
+            for client in self.authorized():
+                # A failed refresh is retried on the next check, or by the client before its next request.
+                try:
+                    token = client.get_token()
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    self.log("Unable to refresh %s access token. %s" % (client.cache_key, e), "debug")
+                    continue
+                if token is None:
+                    self.log("Unable to refresh %s access token." % client.cache_key, "debug")
+
+    def stop(self):
+        self.stopped.set()
@@ -1,14 +1,45 @@
-import requests
 import os
 import sys
+import json
+import datetime
+import threading
+import config
+import sessions
+
+# Seconds to wait for GitHub before giving up, so offline machines do not hang.
+REQUEST_TIMEOUT = 5
+
+# The latest release is looked up on GitHub at most this often.
+RELEASE_CACHE_TTL = datetime.timedelta(hours=6)
+
+
+def default_cache_path():
+    """
+    Location of the cached latest release. Kept next to the settings file.
+    :return: path to json file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(config.config_file_location())),
+                        "lightspeed-vc-connector-release.json")
 
 
 class Update:
 
-    def __init__(self):
+    def __init__(self, session=None, cache_path=None):
         self.project_url = 'https://api.github.com/repos/beckf/lightspeed-vc-connector'
         self.current_version = ''
 
+        # HTTP session, normally on the app's shared connection pool
+        if session is None:
+            session = sessions.pooled_session()
+        self.session = session
+
+        # Latest release, looked up once and shared by update_avail and latest_description
+        if cache_path is None:
+            cache_path = default_cache_path()
+        self.cache_path = cache_path
+        self.release = None
+        self.release_lock = threading.Lock()
+
         # Find working directory for VERSION File
         try:
             self.working_dir = sys._MEIPASS
@@ -26,16 +57,71 @@ class Update:
         except:
             self.current_version = None
 
+    def load_cache(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                return json.load(f)
+        except:
+            return None
+
+    def save_cache(self, release, etag):
+        try:
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"fetched": datetime.datetime.now().isoformat(), "etag": etag, "release": release}, f)
+            os.replace(temp_path, self.cache_path)
+        except:
+            pass
+
+    def latest_release(self):
+        """
+        Latest release from GitHub. Looked up once per run, reused from disk while younger than the
+        cache TTL, and revalidated with the cached ETag after that.
+        :return: release data, or None when unavailable
+        """
+        with self.release_lock:
+            if self.release is not None:
+                return self.release
+
+            cached = self.load_cache()
+            if cached is not None:
+                fetched = datetime.datetime.fromisoformat(cached["fetched"])
+                if datetime.datetime.now() - fetched < RELEASE_CACHE_TTL:
+                    self.release = cached["release"]
+                    return self.release
+
+            headers = dict()
+            if cached is not None and cached.get("etag"):
+                headers['If-None-Match'] = cached["etag"]
+
+            try:
+                r = self.session.get(self.project_url + '/releases/latest', headers=headers,
+                                     timeout=REQUEST_TIMEOUT)
+
+                if r.status_code == 304:
+                    self.release = cached["release"]
+                    self.save_cache(self.release, cached["etag"])
+                elif r.status_code == 200:
+                    self.release = r.json()
+                    self.save_cache(self.release, r.headers.get('ETag'))
+            except:
+                pass
+
+            # Offline or GitHub unavailable, fall back to the last release seen.
+            if self.release is None and cached is not None:
+                self.release = cached["release"]
+
+            return self.release
+
     def update_avail(self):
         """
         Check to see if any updates are available from GitHub
         :return: True/False
         """
         try:
-            r = requests.get(self.project_url + '/releases/latest')
+            d = self.latest_release()
 
-            if r.status_code == 200:
-                d = r.json()
+            if d is not None:
                 if self.current_version == d['tag_name'].rsplit('v', 2)[1]:
                     return False
                 else:
@@ -50,14 +136,12 @@ class Update:
         :return: String Text
         """
         try:
-            r = requests.get(self.project_url + '/releases/latest')
+            d = self.latest_release()
 
-            if r.status_code == 200:
-                d = r.json()
+            if d is not None:
                 if "body" in d:
                     return d["body"]
                 else:
                     return ""
         except:
             return ""
-
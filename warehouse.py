@@ -0,0 +1,249 @@
+import os
+import json
+import sqlite3
+import contextlib
+import datetime
+import threading
+import config
+
+# Sales completed this close to a sync may not be visible yet, so the sync does not mark them as held.
+SYNC_MARGIN = datetime.timedelta(minutes=5)
+
+
+def default_path(account_id, profile=None):
+    """
+    Location of the sales warehouse for a Lightspeed account. Kept next to the settings file.
+    Each profile other than the default has its own, so profiles of the same account never share one.
+    :param account_id: Lightspeed account id
+    :param profile: settings profile name
+    :return: path to sqlite database
+    """
+    name = "lightspeed-vc-connector-sales-%s.db" % account_id
+    if profile is not None and profile != config.DEFAULT_PROFILE:
+        name = "lightspeed-vc-connector-sales-%s-%s.db" % (account_id, config.check_profile_name(profile))
+    return os.path.join(os.path.dirname(config.config_file_location()), name)
+
+
+def to_utc(timestamp):
+    """
+    Normalize a Lightspeed timestamp so timestamps from any offset sort correctly as text.
+    :param timestamp: ISO timestamp such as 2024-01-02T10:00:00-04:00
+    :return: UTC timestamp such as 2024-01-02T14:00:00
+    """
+    return datetime.datetime.fromisoformat(timestamp).astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def parse_utc(timestamp):
+    return datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+
+
+def format_utc(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def local_date(timestamp, utc_offset_iso):
+    """
+    Day a UTC timestamp falls on in a shop's timezone.
+    :param timestamp: UTC timestamp from to_utc
+    :param utc_offset_iso: shop utc offset formatted as -04:00
+    :return: date
+    """
+    tz = datetime.datetime.fromisoformat('2000-01-01T00:00:00' + utc_offset_iso).tzinfo
+    return parse_utc(timestamp).replace(tzinfo=datetime.timezone.utc).astimezone(tz).date()
+
+
+def merge_windows(windows):
+    """
+    Merge overlapping and adjacent windows.
+    :param windows: list of (begin, end) UTC timestamps, both inclusive
+    :return: sorted list of disjoint windows
+    """
+    merged = []
+    for begin, end in sorted(windows):
+        if merged and parse_utc(begin) <= parse_utc(merged[-1][1]) + datetime.timedelta(seconds=1):
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def window_gaps(begin, end, windows):
+    """
+    Parts of a range not covered by any window.
+    :param begin: first UTC timestamp of the range
+    :param end: last UTC timestamp of the range
+    :param windows: covered (begin, end) windows
+    :return: list of (begin, end) gaps
+    """
+    gaps = []
+    for w_begin, w_end in merge_windows(windows):
+        if w_end < begin:
+            continue
+        if w_begin > end:
+            break
+        if w_begin > begin:
+            gaps.append((begin, format_utc(parse_utc(w_begin) - datetime.timedelta(seconds=1))))
+        begin = format_utc(parse_utc(w_end) + datetime.timedelta(seconds=1))
+        if begin > end:
+            return gaps
+    gaps.append((begin, end))
+    return gaps
+
+
+class SalesWarehouse:
+    """
+    Local store of completed Lightspeed sales.
+    Remembers which time windows it holds every sale of, for all shops and customer types or for one
+    shop or customer type, so each sync only fetches what an export needs and is not stored yet.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sales ("
+                       "saleID TEXT PRIMARY KEY, "
+                       "shopID TEXT, "
+                       "customerTypeID TEXT, "
+                       "timeStamp TEXT, "
+                       "data TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS sales_timeStamp ON sales (timeStamp)")
+            # Windows of UTC timeStamps holding every sale of a shop and customer type, an empty
+            # shopID or customerTypeID standing for all of them.
+            db.execute("CREATE TABLE IF NOT EXISTS coverage ("
+                       "shopID TEXT, "
+                       "customerTypeID TEXT, "
+                       "begin TEXT, "
+                       "end TEXT)")
+
+            # Warehouses written before coverage was recorded held every sale between their water marks.
+            if db.execute("SELECT name FROM sqlite_master WHERE name = 'sync_state'").fetchone():
+                state = dict(db.execute("SELECT key, value FROM sync_state"))
+                if state.get("low_water_mark") and state.get("high_water_mark"):
+                    db.execute("INSERT INTO coverage (shopID, customerTypeID, begin, end) VALUES ('', '', ?, ?)",
+                               (state["low_water_mark"], to_utc(state["high_water_mark"])))
+                db.execute("DROP TABLE sync_state")
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Open the database for one transaction.
+        :return: sqlite connection, committed and closed on exit
+        """
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def coverage(self, shop_id=None, customer_type_id=None):
+        """
+        Windows holding every sale of a shop and customer type, including windows held for all of them.
+        :param shop_id: shopID, or None for all shops
+        :param customer_type_id: customerTypeID, or None for all customer types
+        :return: sorted list of (begin, end) UTC timestamps
+        """
+        with self.connect() as db:
+            rows = db.execute("SELECT begin, end FROM coverage WHERE shopID IN ('', ?) AND customerTypeID IN ('', ?)",
+                              (str(shop_id or ''), str(customer_type_id or ''))).fetchall()
+        return merge_windows(rows)
+
+    def add_coverage(self, begin, end, shop_id=None, customer_type_id=None):
+        shop = str(shop_id or '')
+        customer_type = str(customer_type_id or '')
+        with self.connect() as db:
+            rows = db.execute("SELECT begin, end FROM coverage WHERE shopID = ? AND customerTypeID = ?",
+                              (shop, customer_type)).fetchall()
+            db.execute("DELETE FROM coverage WHERE shopID = ? AND customerTypeID = ?", (shop, customer_type))
+            db.executemany("INSERT INTO coverage (shopID, customerTypeID, begin, end) VALUES (?, ?, ?, ?)",
+                           [(shop, customer_type, b, e) for b, e in merge_windows(rows + [(begin, end)])])
+
+    def store(self, sale_list):
+        """
+        Insert or update sales.
+        :param sale_list: Sale records from Lightspeed
+        :return: nothing
+        """
+        rows = []
+        for i in sale_list:
+            customer_type = None
+            if 'Customer' in i:
+                customer_type = str(i['Customer'].get('customerTypeID'))
+            rows.append((str(i['saleID']),
+                         str(i.get('shopID')),
+                         customer_type,
+                         to_utc(i['timeStamp']),
+                         json.dumps(i)))
+
+        with self.connect() as db:
+            db.executemany("INSERT OR REPLACE INTO sales (saleID, shopID, customerTypeID, timeStamp, data) "
+                           "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def sync(self, ls, begin_date, end_date, utc_offset_iso, shop_id=None, customer_type_id=None):
+        """
+        Make sure the warehouse holds every sale of an export range.
+        Only the parts of the range not held yet are fetched, filtered by shop and customer type
+        on the server, and never past end_date. The last SYNC_MARGIN before now is not marked as
+        held, so sales completed late are fetched by the next sync.
+        :param ls: Lightspeed API client
+        :param begin_date: first day of the export range
+        :param end_date: last day of the export range
+        :param utc_offset_iso: shop utc offset formatted as -04:00
+        :param shop_id: optional shopID to fetch sales of
+        :param customer_type_id: optional customerTypeID to fetch sales of
+        :return: number of sales fetched
+        """
+        import sales
+
+        with self.lock:
+            fetched = 0
+            held_until = format_utc(datetime.datetime.now(datetime.timezone.utc) - SYNC_MARGIN)
+            begin = to_utc('{}T00:00:00{}'.format(begin_date, utc_offset_iso))
+            end = to_utc('{}T23:59:59{}'.format(end_date, utc_offset_iso))
+
+            for gap_begin, gap_end in window_gaps(begin, end, self.coverage(shop_id, customer_type_id)):
+                # Lightspeed is asked for whole days in the shop's timezone.
+                first_day = local_date(gap_begin, utc_offset_iso)
+                last_day = local_date(gap_end, utc_offset_iso)
+                fetched_sales = sales.fetch_sales(ls, first_day, last_day, utc_offset_iso,
+                                                  shop_id=shop_id, customer_type_id=customer_type_id)
+                self.store(fetched_sales)
+                fetched += len(fetched_sales)
+
+                held_begin = to_utc('{}T00:00:00{}'.format(first_day, utc_offset_iso))
+                held_end = min(to_utc('{}T23:59:59{}'.format(last_day, utc_offset_iso)), held_until)
+                if held_begin <= held_end:
+                    self.add_coverage(held_begin, held_end, shop_id, customer_type_id)
+
+            return fetched
+
+    def sales(self, begin_date, end_date, utc_offset_iso, shop_id=None, customer_type_id=None):
+        """
+        Query stored sales the same way sales.fetch_sales queries Lightspeed.
+        :param begin_date: first day of the export range
+        :param end_date: last day of the export range
+        :param utc_offset_iso: shop utc offset formatted as -04:00
+        :param shop_id: optional shopID to filter sales to
+        :param customer_type_id: optional customerTypeID to filter sales to
+        :return: generator of sales ordered by timeStamp
+        """
+        query = "SELECT data FROM sales WHERE timeStamp BETWEEN ? AND ?"
+        parameters = [to_utc('{}T00:00:00{}'.format(begin_date, utc_offset_iso)),
+                      to_utc('{}T23:59:59{}'.format(end_date, utc_offset_iso))]
+
+        if shop_id is not None:
+            query += " AND shopID = ?"
+            parameters.append(str(shop_id))
+
+        if customer_type_id is not None:
+            query += " AND customerTypeID = ?"
+            parameters.append(str(customer_type_id))
+
+        query += " ORDER BY timeStamp"
+
+        with self.connect() as db:
+            for r in db.execute(query, parameters):
+                yield json.loads(r[0])
@@ -0,0 +1,161 @@
+import os
+import csv
+import abc
+
+# Rows held by the Parquet writer before a row group is written.
+PARQUET_ROW_GROUP = 10000
+
+
+class ExportWriter(abc.ABC):
+    """
+    Writes export rows to a temporary file as they are produced.
+    The file is renamed into place when closed, so a failed export never leaves a partial file.
+    """
+    extension = ""
+
+    def __init__(self, path, columns):
+        self.path = path + self.extension
+        self.temp_path = self.path + ".part"
+        self.columns = list(columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @abc.abstractmethod
+    def write_rows(self, rows):
+        """
+        Write rows in the writer column order.
+        :param rows: iterable of row tuples
+        :return: nothing
+        """
+
+    def write_frame(self, frame):
+        """
+        Write the rows of a DataFrame with the writer columns.
+        :param frame: pandas DataFrame
+        :return: nothing
+        """
+        self.write_rows(frame.itertuples(index=False, name=None))
+
+    @abc.abstractmethod
+    def finish(self):
+        """
+        Flush and close the temporary file.
+        :return: nothing
+        """
+
+    def close(self):
+        """
+        Finish the file and move it into place.
+        :return: nothing
+        """
+        self.finish()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """
+        Discard the partial file.
+        :return: nothing
+        """
+        try:
+            self.finish()
+        finally:
+            if os.path.isfile(self.temp_path):
+                os.remove(self.temp_path)
+
+
+class CsvWriter(ExportWriter):
+    extension = ".csv"
+
+    def __init__(self, path, columns):
+        super().__init__(path, columns)
+        self.file = open(self.temp_path, "w", newline="", buffering=1024 * 1024)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(self.columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def finish(self):
+        self.file.close()
+
+
+class XlsxWriter(ExportWriter):
+    extension = ".xlsx"
+
+    def __init__(self, path, columns):
+        import xlsxwriter
+
+        super().__init__(path, columns)
+        # constant_memory flushes each row to disk once the next row is started.
+        self.workbook = xlsxwriter.Workbook(self.temp_path, {'constant_memory': True})
+        self.worksheet = self.workbook.add_worksheet()
+        self.worksheet.write_row(0, 0, self.columns)
+        self.row = 1
+
+    def write_rows(self, rows):
+        for r in rows:
+            self.worksheet.write_row(self.row, 0, r)
+            self.row += 1
+
+    def finish(self):
+        self.workbook.close()
+
+
+class ParquetWriter(ExportWriter):
+    extension = ".parquet"
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet export requires the pyarrow package.")
+
+        super().__init__(path, columns)
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([(c, pyarrow.string()) for c in self.columns])
+        self.writer = pyarrow.parquet.ParquetWriter(self.temp_path, self.schema)
+        self.buffer = []
+
+    def write_rows(self, rows):
+        for r in rows:
+            self.buffer.append(r)
+            if len(self.buffer) >= PARQUET_ROW_GROUP:
+                self.flush()
+
+    def flush(self):
+        if self.buffer:
+            columns = [[None if v is None else str(v) for v in c] for c in zip(*self.buffer)]
+            self.writer.write_table(self.pyarrow.Table.from_arrays(columns, schema=self.schema))
+            self.buffer = []
+
+    def finish(self):
+        try:
+            self.flush()
+        finally:
+            self.writer.close()
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "xlsx": XlsxWriter,
+    "parquet": ParquetWriter
+}
+
+
+def open_writer(file_format, path, columns):
+    """
+    Open a streaming writer for an export file.
+    :param file_format: csv, xlsx or parquet
+    :param path: export file path without extension
+    :param columns: header row
+    :return: ExportWriter
+    """
+    return WRITERS[file_format](path, columns)